@@ -1,11 +1,14 @@
-import sqlite3
 from api_utils import (
     fetch_paper_details,
+    fetch_paper_details_batch,
     parse_paper_details,
-    fetch_citations,
-    parse_citation_data
+    parse_citation_edges,
+    stream_citations,
+    is_valid_doi,
+    S2_BATCH_SIZE
 )
 from db_utils import (
+    ensure_last_fetched_columns,
     insert_paper,
     insert_author,
     insert_citation,
@@ -14,11 +17,14 @@ from db_utils import (
     insert_keywords,
     link_paper_keywords,
     get_all_dois,
-    is_doi_in_dataset
+    get_dois_without_citations
 )
-from config import DATABASE_PATH, FILE_PATH
+from interning import get_interner
+from config import DATABASE_PATH, FILE_PATH, LOG_SAMPLE_EVERY, LOG_PROGRESS_INTERVAL
 import logging
-from logging_config import setup_logging
+from logging_config import setup_logging, log_every_n, log_throttled
+import metrics
+from working_db import working_database, connect
 import time
 import pandas as pd
 
@@ -54,8 +60,9 @@ def validate_paper_data(paper_data):
     
     return True            
 
-def process_papers(connection):
-    doi_keywords = load_dois_and_keywords()
+def process_papers(connection, doi_keywords=None):
+    if doi_keywords is None:
+        doi_keywords = load_dois_and_keywords()
     papers_processed = 0
 
     for _, row in doi_keywords.iterrows():
@@ -68,11 +75,114 @@ def process_papers(connection):
                     paper = parse_paper_details(paper_data, doi)
                     process_single_paper(paper[0], connection, keywords)
                     papers_processed += 1
-                    logger.info(f"Processed {papers_processed} papers.")
+                    metrics.increment('papers_processed_total')
+                    if papers_processed % 100 == 0:
+                        logger.info(f"Processed {papers_processed} papers.")
                 else:
                     logger.error(f"Invalid data for DOI {doi}, skipping.")
+                    metrics.increment('papers_skipped_total', reason='invalid')
         else:
             logger.error(f"No details fetched for DOI {doi}, skipping. Error: {error_message}")
+            metrics.increment('papers_skipped_total', reason='fetch_failed')
+
+def resolve_edges(edges, stored_dois):
+    """Map lower-cased edges to the DOI spelling stored in Papers.
+
+    Returns the edges whose both ends are in ``stored_dois`` and the set of the rest.
+    """
+    resolved, unresolved = [], set()
+    for citing_doi, cited_doi in edges:
+        if citing_doi in stored_dois and cited_doi in stored_dois:
+            resolved.append((stored_dois[citing_doi], stored_dois[cited_doi]))
+        else:
+            unresolved.add((citing_doi, cited_doi))
+    return resolved, unresolved
+
+def process_papers_one_pass(connection, include_citations=False, batch_size=S2_BATCH_SIZE,
+                            doi_keywords=None, corpus_dois=None):
+    """Ingest papers and their citation edges from batched S2 requests in one pass.
+
+    References (and optionally citations) are requested alongside the paper metadata
+    and resolved against the DOIs in the preprocessed corpus, so edges are written
+    while the papers are ingested instead of in a second OpenCitations crawl.  Like
+    process_citations, an edge is only written once both of its papers are in Papers;
+    edges waiting on a paper of a later batch are held until it is ingested.
+
+    ``doi_keywords`` restricts ingestion to part of the corpus; ``corpus_dois`` should
+    then map every lower-cased corpus DOI to its CSV spelling so edges to papers of the
+    other parts are kept too (shard_ingest drops those whose paper never got ingested).
+    """
+    if doi_keywords is None:
+        doi_keywords = load_dois_and_keywords()
+    partial = corpus_dois is not None
+    if corpus_dois is None:
+        corpus_dois = {doi.strip().lower(): doi for doi in doi_keywords['DOI']}
+    # Lower-cased DOI -> spelling stored in Papers, for papers ingested so far
+    stored_dois = {doi.strip().lower(): doi for doi in get_all_dois(connection)}
+    rows = [
+        (doi, keywords) for doi, keywords in zip(doi_keywords['DOI'], doi_keywords['Keywords'])
+        if is_valid_doi(doi)
+    ]
+    papers_processed = 0
+    edges_found = 0
+    pending_edges = set()
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        paper_details, error_message = fetch_paper_details_batch(
+            [doi for doi, _ in batch], include_citations=include_citations)
+        if not paper_details:
+            logger.error(f"No details fetched for batch starting at row {start}, skipping. Error: {error_message}")
+            metrics.increment('papers_skipped_total', len(batch), reason='fetch_failed')
+            continue
+
+        valid = []
+        for (doi, keywords), paper_data in zip(batch, paper_details):
+            if not paper_data or not validate_paper_data(paper_data):
+                logger.error(f"Invalid data for DOI {doi}, skipping.")
+                metrics.increment('papers_skipped_total', reason='invalid')
+                continue
+            valid.append((doi, keywords.split(';'), paper_data))
+
+        # Intern the journals and keywords of the papers being ingested with one upsert each
+        get_interner(connection, 'Keywords').resolve(
+            [keyword for _, keywords, _ in valid for keyword in keywords])
+        get_interner(connection, 'Journals').resolve(
+            [paper_data['journal']['name'] for _, _, paper_data in valid
+             if (paper_data.get('journal') or {}).get('name')])
+
+        for doi, keywords, paper_data in valid:
+            paper = parse_paper_details(paper_data, doi)
+            process_single_paper(paper[0], connection, keywords)
+            stored_dois[doi.strip().lower()] = doi
+            pending_edges.update(parse_citation_edges(paper_data, doi, corpus_dois))
+            papers_processed += 1
+            metrics.increment('papers_processed_total')
+
+        edges, pending_edges = resolve_edges(pending_edges, stored_dois)
+        for citing_doi, cited_doi in edges:
+            insert_citation(citing_doi, cited_doi, connection)
+        edges_found += len(edges)
+        logger.info(f"Processed {papers_processed} papers, {edges_found} citation edges.")
+
+    if partial:
+        # Edges to papers of the other parts are kept under their CSV spelling (the one
+        # stored in Papers); edges to papers of this part that failed are still dropped
+        part_dois = {doi.strip().lower() for doi, _ in rows}
+        external = [
+            (citing_doi, cited_doi) for citing_doi, cited_doi in pending_edges
+            if all(end in stored_dois or end not in part_dois for end in (citing_doi, cited_doi))
+        ]
+        for citing_doi, cited_doi in external:
+            insert_citation(stored_dois.get(citing_doi, corpus_dois[citing_doi]),
+                            stored_dois.get(cited_doi, corpus_dois[cited_doi]), connection)
+        edges_found += len(external)
+        pending_edges.difference_update(external)
+    if pending_edges:
+        logger.info(f"Dropped {len(pending_edges)} citation edges to papers that were not ingested.")
+    metrics.increment('citations_matched_total', edges_found)
+    metrics.increment('citations_mismatched_total', len(pending_edges))
+    logger.info(f"One-pass ingestion finished: {papers_processed} papers, {edges_found} citation edges.")
 
 def process_single_paper(paper, connection, keywords):
     if paper.get('journal') and paper['journal'].get('name'):
@@ -90,9 +200,12 @@ def process_single_author(author, paper_doi, connection):
     # Link the author to the paper in the Authorship table
     insert_authorship(author['author_id'], paper_doi, connection)
 
-def process_citations(connection):
-    """Process citations, excluding already processed DOIs."""
-    all_dois = get_all_dois(connection)
+def process_citations(connection, dois=None):
+    """Process citations from OpenCitations for the given DOIs (default: every paper)."""
+    all_dois = get_all_dois(connection) if dois is None else dois
+    # Membership is checked in memory instead of two queries per citation pair; the map
+    # restores the DOI spelling stored in Papers from the lower-cased OpenCitations form
+    corpus_dois = {doi.strip().lower(): doi for doi in get_all_dois(connection)}
     processed_count = 0
     matched_count = 0
     mismatched_count = 0
@@ -105,44 +218,70 @@ def process_citations(connection):
     logger.info(f"Total DOIs to process for citations: {len(all_dois)}")
 
     for doi in all_dois:
-        print(doi)
+        log_every_n(logger, logging.DEBUG, 'process_citations', LOG_SAMPLE_EVERY,
+                    "Fetching citations for DOI %s", doi)
         try:
-            citation_data = fetch_citations(doi)
-            if citation_data:
-                parsed_citations = parse_citation_data(citation_data)
-                for citation in parsed_citations:
-                    citing_doi = citation['citing_doi']
-                    cited_doi = citation['cited_doi']
-                    if is_doi_in_dataset(citing_doi, connection) and is_doi_in_dataset(cited_doi, connection):
-                        insert_citation(citing_doi, cited_doi, connection)
-                        matched_count += 1
-                    else:
-                        mismatched_count += 1
-            else:
+            pairs_seen = 0
+            for citing_doi, cited_doi in stream_citations(doi):
+                pairs_seen += 1
+                if citing_doi in corpus_dois and cited_doi in corpus_dois:
+                    insert_citation(corpus_dois[citing_doi], corpus_dois[cited_doi], connection)
+                    matched_count += 1
+                else:
+                    mismatched_count += 1
+            if not pairs_seen:
                 logger.warning(f"No citation data found for DOI {doi}.")
             processed_count += 1
+            metrics.increment('citation_dois_processed_total')
         except Exception as e:
             logger.error(f"Error processing DOI {doi}: {str(e)}")
             failed_count += 1
+            metrics.increment('citation_dois_failed_total')
             time.sleep(1)  # Sleep to handle rate limiting
 
-        # Periodically log progress
-        if processed_count % 100 == 0:
-            logger.info(f"Progress: {processed_count} DOIs processed, {matched_count} matched, {mismatched_count} mismatched, {failed_count} failed.")
+        # Periodically log progress; time-based, since failed DOIs leave processed_count unchanged
+        log_throttled(logger, logging.INFO, 'process_citations_progress', LOG_PROGRESS_INTERVAL,
+                      "Progress: %d DOIs processed, %d matched, %d mismatched, %d failed.",
+                      processed_count, matched_count, mismatched_count, failed_count)
 
+    metrics.increment('citations_matched_total', matched_count)
+    metrics.increment('citations_mismatched_total', mismatched_count)
     logger.info("Database connection closed.")
     logger.info(f"Final Report: {matched_count} matched, {mismatched_count} mismatched, {failed_count} failed out of {processed_count} processed DOIs.")
 
-def main():
-    with sqlite3.connect(DATABASE_PATH) as connection:
+def fill_citation_gaps(connection):
+    """Use OpenCitations only for papers the one-pass ingestion found no edges for."""
+    dois = get_dois_without_citations(connection)
+    logger.info(f"Filling citation gaps from OpenCitations for {len(dois)} DOIs.")
+    process_citations(connection, dois)
+
+def main(run_papers=False, run_citations=True, one_pass=False, fill_gaps=False):
+    """Run the ingestion stages.
+
+    ``one_pass`` ingests papers and citation edges together from S2 and replaces
+    ``run_papers``/``run_citations``; ``fill_gaps`` then tops it up from OpenCitations.
+    """
+    metrics.start_exporter()
+    # With IN_MEMORY_DB the run writes to memory and is snapshotted back to DATABASE_PATH
+    with working_database(DATABASE_PATH), connect(DATABASE_PATH) as connection:
         logging.info("Database connection established.")
-        run_papers = False
-        run_citations = True
+        # Inserts write last_fetched, which databases created before it was added lack
+        ensure_last_fetched_columns(connection)
+
+        if one_pass:
+            with metrics.timer('stage', stage='one_pass'):
+                process_papers_one_pass(connection)
+            if fill_gaps:
+                with metrics.timer('stage', stage='citation_gaps'):
+                    fill_citation_gaps(connection)
+            run_papers = run_citations = False
 
         if run_papers:
-            process_papers(connection)
+            with metrics.timer('stage', stage='papers'):
+                process_papers(connection)
         if run_citations:
-            process_citations(connection)
+            with metrics.timer('stage', stage='citations'):
+                process_citations(connection)
 
         # Log row counts for each table at the end of the process
         count_rows("Papers", connection)
@@ -5,6 +5,8 @@ import logging
 import os
 import sys
 import re
+import json
+import threading
 
 
 # Adjust sys.path before any other imports
@@ -12,35 +14,87 @@ current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current
 project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
 sys.path.insert(0, project_root)  # Add project root to the start of the search path
 from logging_config import setup_logging
+from config import S2_REQUEST_INTERVAL
+import metrics
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
+S2_BATCH_URL = 'https://api.semanticscholar.org/graph/v1/paper/batch'
+PAPER_FIELDS = 'title,year,authors,authors.paperCount,authors.citationCount,authors.hIndex,authors.name,citationCount,referenceCount,journal,embedding.specter_v1,influentialCitationCount'
+S2_AUTHOR_BATCH_URL = 'https://api.semanticscholar.org/graph/v1/author/batch'
+AUTHOR_FIELDS = 'name,paperCount,citationCount,hIndex'
+# Kept well below the API limit of 500 ids because embeddings and references make responses large
+S2_BATCH_SIZE = 100
+
 def is_valid_doi(doi):
     doi_regex = r'^10.\d{4,9}/[-._;()/:A-Z0-9]+$'
     return re.match(doi_regex, doi, re.IGNORECASE) is not None
 
+# Earliest time.time() at which the next S2 request may be sent. Shard workers share one
+# multiprocessing.Value (see share_rate_limit) so the API key's rate is split between them.
+_next_request_slot = None
+_local_next_request_slot = 0.0
+_local_slot_lock = threading.Lock()
+
+def share_rate_limit(next_slot):
+    """Pace this process's requests with a multiprocessing.Value('d') shared with other processes."""
+    global _next_request_slot
+    _next_request_slot = next_slot
+
+def _reserve_slot(delay):
+    """Claim the next free request slot at least ``delay`` seconds from now; return its time."""
+    global _local_next_request_slot
+    lock = _next_request_slot.get_lock() if _next_request_slot is not None else _local_slot_lock
+    with lock:
+        next_slot = _next_request_slot.value if _next_request_slot is not None else _local_next_request_slot
+        slot = max(time.time() + delay, next_slot)
+        if _next_request_slot is not None:
+            _next_request_slot.value = slot + S2_REQUEST_INTERVAL
+        else:
+            _local_next_request_slot = slot + S2_REQUEST_INTERVAL
+    return slot
+
+def wait_for_request_slot(delay=0.0):
+    """Sleep until this process may send its next S2 request.
+
+    Slots are spaced S2_REQUEST_INTERVAL apart across every process sharing the limiter,
+    and a backoff ``delay`` after a 429 pushes the slot out for all of them.
+    """
+    wait = _reserve_slot(delay) - time.time()
+    if wait > 0:
+        metrics.observe('api_rate_wait_seconds', wait, api='semantic_scholar')
+        time.sleep(wait)
+
 def rate_limited_request(url, params=None, headers=None, json_data=None, max_retries=5, initial_wait=1.1):
     headers = headers or {}
     headers['x-api-key'] = API_KEY.strip()
     retries = 0
     wait_time = initial_wait
+    delay = 0.0
 
     while retries < max_retries:
+        wait_for_request_slot(delay)
+        delay = 0.0
         try:
-            response = requests.post(url, params=params, headers=headers, json=json_data)
+            metrics.increment('api_requests_total', api='semantic_scholar')
+            with metrics.timer('api_request', api='semantic_scholar'):
+                response = requests.post(url, params=params, headers=headers, json=json_data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
             logging.error(f"HTTP error: {str(e)} - Status code: {response.status_code}")
+            metrics.increment('api_errors_total', api='semantic_scholar', status=response.status_code)
             logging.error(f"Response: {response.text}")
             if response.status_code == 400:
                 logging.error("Bad request, possibly due to invalid DOI or malformed request.")
                 return None
             elif response.status_code == 429:
                 logging.error("Too many requests. Retrying after wait.")
-                time.sleep(wait_time)
+                metrics.increment('api_rate_limited_total', api='semantic_scholar')
+                metrics.increment('api_retries_total', api='semantic_scholar')
+                delay = wait_time  # Backs off every process sharing the limiter, not just this one
                 wait_time *= 2  # Exponential backoff
                 retries += 1
             else:
@@ -48,11 +102,13 @@ def rate_limited_request(url, params=None, headers=None, json_data=None, max_ret
                 return None
         except requests.exceptions.RequestException as e:
             logging.error(f"Request exception: {str(e)}")
+            metrics.increment('api_retries_total', api='semantic_scholar')
             time.sleep(wait_time)
             wait_time *= 2  # Exponential backoff
             retries += 1
 
     logging.error("Max retries exceeded. Request failed.")
+    metrics.increment('api_failures_total', api='semantic_scholar')
     return None
 
 def fetch_paper_details(doi):
@@ -64,10 +120,10 @@ def fetch_paper_details(doi):
         logging.error(f"Invalid DOI format: {doi}")
         return None, "Invalid DOI format"
 
-    url = 'https://api.semanticscholar.org/graph/v1/paper/batch'
+    url = S2_BATCH_URL
     data = {"ids": [doi]}
     params = {
-        'fields': 'title,year,authors,authors.paperCount,authors.citationCount,authors.hIndex,authors.name,citationCount,referenceCount,journal,embedding.specter_v1,influentialCitationCount'
+        'fields': PAPER_FIELDS
     }
     headers = {'x-api-key': API_KEY.strip()}
 
@@ -92,6 +148,82 @@ def fetch_paper_details(doi):
 
     return paper_data, None
 
+def fetch_paper_details_batch(dois, include_references=True, include_citations=False, fields=PAPER_FIELDS):
+    """Fetch paper details for a batch of DOIs in a single Semantic Scholar request.
+
+    With ``include_references``/``include_citations`` the DOIs of referenced and citing
+    papers come back in the same response, so no separate citation crawl is needed.
+    Returns a list aligned with ``dois`` (None for papers S2 does not know) and an error.
+    """
+    if not dois:
+        return None, "No DOIs given"
+    if len(dois) > 500:
+        return None, "At most 500 DOIs per batch"
+
+    if include_references:
+        fields += ',references.externalIds'
+    if include_citations:
+        fields += ',citations.externalIds'
+
+    response = rate_limited_request(S2_BATCH_URL, params={'fields': fields}, json_data={"ids": list(dois)})
+
+    if response is None:
+        error_msg = "API response is None"
+        logging.error(error_msg)
+        return None, error_msg
+
+    if not isinstance(response, list) or len(response) != len(dois):
+        error_msg = "Unexpected API response format"
+        logging.error(error_msg)
+        return None, error_msg
+
+    return response, None
+
+def fetch_author_details_batch(author_ids, fields=AUTHOR_FIELDS):
+    """Fetch author details for up to 1000 S2 author IDs in a single request.
+
+    Returns a list aligned with ``author_ids`` (None for unknown authors) and an error.
+    """
+    if not author_ids:
+        return None, "No author IDs given"
+    if len(author_ids) > 1000:
+        return None, "At most 1000 author IDs per batch"
+
+    response = rate_limited_request(S2_AUTHOR_BATCH_URL, params={'fields': fields}, json_data={"ids": list(author_ids)})
+
+    if response is None:
+        error_msg = "API response is None"
+        logging.error(error_msg)
+        return None, error_msg
+
+    if not isinstance(response, list) or len(response) != len(author_ids):
+        error_msg = "Unexpected API response format"
+        logging.error(error_msg)
+        return None, error_msg
+
+    return response, None
+
+def extract_dois(linked_papers):
+    """Collect the lower-cased DOIs of the papers in a references/citations list."""
+    dois = []
+    for linked_paper in linked_papers or []:
+        doi = (linked_paper.get('externalIds') or {}).get('DOI') if linked_paper else None
+        if doi:
+            dois.append(doi.strip().lower())
+    return dois
+
+def parse_citation_edges(paper_data, doi, corpus_dois):
+    """Build lower-cased (citing_doi, cited_doi) edges from S2 references/citations within the corpus."""
+    doi = doi.strip().lower()
+    edges = set()
+    for cited_doi in extract_dois(paper_data.get('references')):
+        if cited_doi in corpus_dois and cited_doi != doi:
+            edges.add((doi, cited_doi))
+    for citing_doi in extract_dois(paper_data.get('citations')):
+        if citing_doi in corpus_dois and citing_doi != doi:
+            edges.add((citing_doi, doi))
+    return edges
+
 def parse_paper_details(paper_data, doi):
     if not paper_data:
         return []
@@ -123,44 +255,83 @@ def parse_paper_details(paper_data, doi):
     return [paper]
 
 # Citations
-def fetch_citations(doi):
-    """Fetches citations for a given DOI using the OpenCitations API."""
-    url = f"https://opencitations.net/index/api/v2/citations/doi:{doi}"
+OC_CITATIONS_URL = 'https://opencitations.net/index/api/v2/citations/doi:{doi}'
+# OpenCitations lists ids as "omid:br/... doi:10.xxx/yyy pmid:..."; capture the DOI token
+OC_DOI_PATTERN = re.compile(r'(?:^|\s)doi:(\S+)')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def iter_json_array(text_chunks):
+    """Incrementally decode a top-level JSON array, yielding one element at a time.
+
+    Only the unparsed tail of the stream is buffered, so memory stays bounded by the
+    chunk size plus one element no matter how long the array is.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in text_chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Element continues in the next chunk
+            if end == len(buffer) or buffer[end] not in ' \t\r\n,]':
+                # A scalar cut at a chunk boundary ("[1" | "2]", "[1" | ".5]") decodes
+                # cleanly but may go on in the next chunk; wait for the separator
+                break
+            pos = end
+            yield element
+        buffer = buffer[pos:]
+    if started:
+        raise ValueError("Truncated or malformed JSON array")
+
+def extract_oc_doi(ids):
+    """Return the lower-cased DOI from an OpenCitations id list, or None."""
+    match = OC_DOI_PATTERN.search(ids or '')
+    return match.group(1).lower() if match else None
+
+def stream_citations(doi):
+    """Lazily yield (citing_doi, cited_doi) pairs for a DOI from a streamed OpenCitations response.
+
+    The full payload is never materialized, so highly cited papers cost the same memory
+    as any other.
+    """
+    url = OC_CITATIONS_URL.format(doi=doi)
     headers = {
         'authorization': OC_API_KEY,
         'Accept': 'application/json'
     }
+    metrics.increment('api_requests_total', api='opencitations')
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Will raise an exception for HTTP error codes
-        #print(f"Response for DOI {doi}: {response.json()}")  # Print the response for debugging
-        return response.json()
+        with requests.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 429:
+                metrics.increment('api_rate_limited_total', api='opencitations')
+            response.raise_for_status()
+            response.encoding = response.encoding or 'utf-8'
+            for citation in iter_json_array(response.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True)):
+                citing_doi = extract_oc_doi(citation.get('citing'))
+                cited_doi = extract_oc_doi(citation.get('cited'))
+                if citing_doi and cited_doi:
+                    yield citing_doi, cited_doi
+                else:
+                    metrics.increment('oc_invalid_citations_total')
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error fetching citations for DOI {doi}: {str(e)}")
+        metrics.increment('api_errors_total', api='opencitations', status=response.status_code)
     except requests.exceptions.RequestException as e:
         logger.error(f"Request exception fetching citations for DOI {doi}: {str(e)}")
-    return []
-
-
-def parse_citation_data(citation_data):
-    """Parses the JSON data returned from the OpenCitations API to extract relevant citation details."""
-    parsed_data = []
-    for citation in citation_data:
-        citing_details = citation.get('citing', '').split(' ')
-        cited_details = citation.get('cited', '').split(' ')
-        
-        # Extract DOIs from the citation details, assuming the DOI always follows the prefix 'doi:'
-        citing_doi = next((detail.split(':')[-1] for detail in citing_details if 'doi:' in detail), None)
-        cited_doi = next((detail.split(':')[-1] for detail in cited_details if 'doi:' in detail), None)
-
-        if citing_doi and cited_doi:
-            parsed_entry = {
-                'citing_doi': citing_doi,
-                'cited_doi': cited_doi,
-            }
-            parsed_data.append(parsed_entry)
-        else:
-            logger.warning(f"Invalid citation data: {citation}")
-
-    return parsed_data
-
+        metrics.increment('api_failures_total', api='opencitations')
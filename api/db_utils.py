@@ -2,16 +2,24 @@ import sqlite3
 import logging
 import pandas as pd
 import json
-from logging_config import setup_logging
+from logging_config import setup_logging, log_every_n
+from config import LOG_SAMPLE_EVERY
+import metrics
+from interning import get_interner
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# Cache dictionary to store journal names and their IDs during the process
-journal_cache = {}
-# Cache dictionary to store keyword names and their IDs during the process
-keyword_cache = {}
+def commit(connection):
+    """Commit the current transaction, recording its latency."""
+    with metrics.timer('db_commit'):
+        connection.commit()
+
+def record_rows(cursor, table):
+    """Count the rows the last statement actually wrote to a table."""
+    if cursor.rowcount > 0:
+        metrics.increment('db_rows_written_total', cursor.rowcount, table=table)
 
 def insert_paper(data, connection):
     """Insert paper data into the database."""
@@ -19,15 +27,17 @@ def insert_paper(data, connection):
         cursor = connection.cursor()
         cursor.execute("""
             INSERT OR IGNORE INTO Papers (
-                doi, paper_id, title, year, citation_count, reference_count, influential_citation_count, journal_id, embedding
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                doi, paper_id, title, year, citation_count, reference_count, influential_citation_count, journal_id, embedding,
+                last_fetched
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
         """, (
             data.get('doi'), data.get('paper_id'), data.get('title'),
             data.get('year'), data.get('citation_count'), data.get('reference_count'),
             data.get('influential_citation_count'), data.get('journal_id'),
             json.dumps(data.get('embedding'))  # Serialize embedding to JSON
         ))
-        connection.commit()
+        record_rows(cursor, 'Papers')
+        commit(connection)
         #logger.info(f"Paper inserted/updated: {data['doi']}")
     except sqlite3.IntegrityError as e:
         logger.error(f"Integrity error during paper insert: {e}")
@@ -39,13 +49,14 @@ def insert_author(data, connection):
         cursor = connection.cursor()
         cursor.execute("""
             INSERT OR IGNORE INTO Authors (
-                author_id, name, paperCount, citationCount, hIndex
-            ) VALUES (?, ?, ?, ?, ?)
+                author_id, name, paperCount, citationCount, hIndex, last_fetched
+            ) VALUES (?, ?, ?, ?, ?, datetime('now'))
         """, (
             data.get('author_id'), data.get('name'),
             data.get('paperCount'), data.get('citationCount'), data.get('hIndex')
         ))
-        connection.commit()
+        record_rows(cursor, 'Authors')
+        commit(connection)
         #logger.info(f"Author inserted/updated: {data['name']} with ID: {data['author_id']}")
     except sqlite3.IntegrityError as e:
         logger.error(f"Integrity error during author insert: {e}")
@@ -53,7 +64,8 @@ def insert_author(data, connection):
         logger.error(f"Failed to insert author data: {e}")
 
 def insert_authorship(author_id, doi, connection):
-    logger.debug(f"Inserting authorship: author_id={author_id}, doi={doi}")
+    log_every_n(logger, logging.DEBUG, 'insert_authorship', LOG_SAMPLE_EVERY,
+                "Inserting authorship: author_id=%s, doi=%s", author_id, doi)
     try:
         cursor = connection.cursor()
         cursor.execute("""
@@ -61,7 +73,8 @@ def insert_authorship(author_id, doi, connection):
                 author_id, doi
             ) VALUES (?, ?)
         """, (author_id, doi))
-        connection.commit()
+        record_rows(cursor, 'Authorship')
+        commit(connection)
         #logger.info(f"Authorship inserted/updated for author_id: {author_id}, doi: {doi}")
     except sqlite3.IntegrityError as e:
         logger.error(f"Integrity error during authorship insert: {e}")
@@ -69,29 +82,11 @@ def insert_authorship(author_id, doi, connection):
         logger.error(f"Failed to insert authorship data: {e}")
 
 def insert_journal(journal_name, connection):
-    global journal_cache
-
-    # Check if the journal is already in the cache
-    if journal_name in journal_cache:
-        return journal_cache[journal_name]
-
+    """Return the ID of a journal, inserting it if it is new."""
     try:
-        cursor = connection.cursor()
-        # Check if the journal is already in the database
-        cursor.execute("SELECT journal_id FROM Journals WHERE name = ?", (journal_name,))
-        journal_id = cursor.fetchone()
-
-        if journal_id:
-            journal_id = journal_id[0]
-        else:
-            # Insert the journal into the database
-            cursor.execute("INSERT OR IGNORE INTO Journals (name) VALUES (?)", (journal_name,))
-            connection.commit()
-            journal_id = cursor.lastrowid
-
-        # Update the cache with the journal
-        journal_cache[journal_name] = journal_id
-        logger.info(f"Journal inserted/updated: {journal_name} with ID: {journal_id}")
+        journal_id = get_interner(connection, 'Journals').resolve([journal_name])[0]
+        log_every_n(logger, logging.INFO, 'insert_journal', LOG_SAMPLE_EVERY,
+                    "Journal inserted/updated: %s with ID: %s", journal_name, journal_id)
         return journal_id
     except sqlite3.IntegrityError as e:
         logger.error(f"Integrity error during journal insert: {e}")
@@ -101,36 +96,8 @@ def insert_journal(journal_name, connection):
         return None
 
 def insert_keywords(keywords, connection):
-    global keyword_cache
-
-    cursor = connection.cursor()
-    keyword_ids = []
-
-    for keyword in keywords:
-        # Check if the keyword is already in the cache
-        if keyword in keyword_cache:
-            keyword_ids.append(keyword_cache[keyword])
-            continue
-
-        # Check if the keyword is already in the database
-        cursor.execute("SELECT id FROM Keywords WHERE keyword = ?", (keyword,))
-        keyword_id = cursor.fetchone()
-
-        if keyword_id:
-            keyword_id = keyword_id[0]
-        else:
-            # Insert the keyword into the database
-            cursor.execute("INSERT OR IGNORE INTO Keywords (keyword) VALUES (?)", (keyword,))
-            connection.commit()
-            keyword_id = cursor.lastrowid
-
-        # Update the cache with the keyword
-        keyword_cache[keyword] = keyword_id
-        keyword_ids.append(keyword_id)
-
-        #logger.info(f"Keyword inserted/updated: {keyword} with ID: {keyword_id}")
-
-    return keyword_ids
+    """Return the IDs of the given keywords (in order), inserting new ones in one statement."""
+    return get_interner(connection, 'Keywords').resolve(list(keywords))
 
 def link_paper_keywords(paper_doi, keyword_ids, connection):
     """Associates keywords with a paper in the PaperKeywords table."""
@@ -140,7 +107,8 @@ def link_paper_keywords(paper_doi, keyword_ids, connection):
             INSERT OR IGNORE INTO PaperKeywords (paper_id, keyword_id)
             VALUES (?, ?)
         """, (paper_doi, keyword_id))
-    connection.commit()
+        record_rows(cursor, 'PaperKeywords')
+    commit(connection)
 
 def get_all_dois(connection):
     """Retrieve all DOIs from the database."""
@@ -149,6 +117,58 @@ def get_all_dois(connection):
     dois = [row[0] for row in cursor.fetchall()]
     return dois
 
+def ensure_last_fetched_columns(connection):
+    """Add the last_fetched column to Papers and Authors in databases created before it existed."""
+    cursor = connection.cursor()
+    for table in ('Papers', 'Authors'):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if 'last_fetched' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN last_fetched TEXT")
+            logger.info(f"Added last_fetched column to {table}.")
+    commit(connection)
+
+def upsert_changed_columns(table, key_column, rows, connection):
+    """Upsert rows keyed by ``key_column``, writing only the columns whose values changed.
+
+    Every upserted row gets a fresh last_fetched timestamp, even when nothing changed.
+    Returns the number of rows that had at least one changed column.
+    """
+    if not rows:
+        return 0
+    cursor = connection.cursor()
+    changed_rows = 0
+    for row in rows:
+        columns = [column for column in row if column != key_column]
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE {key_column} = ?", (row[key_column],))
+        current = cursor.fetchone()
+        if current is None:
+            changed = columns
+        else:
+            changed = [column for column, old in zip(columns, current) if row[column] != old]
+        insert_columns = [key_column] + columns + ['last_fetched']
+        assignments = [f"{column} = excluded.{column}" for column in changed] + ["last_fetched = excluded.last_fetched"]
+        cursor.execute(f"""
+            INSERT INTO {table} ({', '.join(insert_columns)})
+            VALUES ({', '.join('?' for _ in insert_columns[:-1])}, datetime('now'))
+            ON CONFLICT({key_column}) DO UPDATE SET {', '.join(assignments)}
+        """, [row[key_column]] + [row[column] for column in columns])
+        if changed:
+            changed_rows += 1
+    metrics.increment('db_rows_written_total', changed_rows, table=table)
+    commit(connection)
+    return changed_rows
+
+def get_dois_without_citations(connection):
+    """Retrieve DOIs of papers that do not take part in any citation edge."""
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT doi FROM Papers p
+        WHERE NOT EXISTS (SELECT 1 FROM Citations c WHERE c.citing_doi = p.doi)
+          AND NOT EXISTS (SELECT 1 FROM Citations c WHERE c.cited_doi = p.doi)
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
 def is_doi_in_dataset(doi, connection):
     """Check if a DOI exists in the database."""
     cursor = connection.cursor()
@@ -163,7 +183,8 @@ def insert_citation(citing_doi, cited_doi, connection):
         cursor.execute("""
             INSERT OR IGNORE INTO Citations (citing_doi, cited_doi) VALUES (?, ?)
         """, (citing_doi, cited_doi))
-        connection.commit()
+        record_rows(cursor, 'Citations')
+        commit(connection)
     except sqlite3.IntegrityError as e:
         connection.rollback()
         logger.error(f"Failed to insert citation from {citing_doi} to {cited_doi}: {e}")
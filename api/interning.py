@@ -0,0 +1,141 @@
+import logging
+import sqlite3
+from collections import OrderedDict
+from logging_config import setup_logging
+from config import INTERN_CACHE_SIZE
+import metrics
+
+# Setup logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Names per multi-row statement, well under SQLite's bound-parameter limit
+UPSERT_CHUNK_SIZE = 500
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Lookup tables that map a unique name column to an integer ID
+INTERNED_TABLES = {
+    'Journals': ('journal_id', 'name'),
+    'Keywords': ('id', 'keyword'),
+}
+
+class NameInterner:
+    """Bounded LRU map from names to integer IDs for one lookup table.
+
+    Misses are resolved in bulk with a single multi-row upsert that returns the IDs
+    the database actually holds, so the result is correct whether a row was just
+    inserted, already existed, or was inserted concurrently by another writer.
+    """
+
+    def __init__(self, connection, table, capacity=INTERN_CACHE_SIZE):
+        self.connection = connection
+        self.table = table
+        self.id_column, self.name_column = INTERNED_TABLES[table]
+        self.capacity = capacity
+        self.cache = OrderedDict()
+
+    def preload(self):
+        """Bulk-load existing name->ID pairs, newest first, up to the cache capacity."""
+        cursor = self.connection.execute(
+            f"SELECT {self.name_column}, {self.id_column} FROM {self.table} ORDER BY {self.id_column} DESC LIMIT ?",
+            (self.capacity,))
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for name, row_id in rows:
+                self.cache[name] = row_id
+        # Oldest loaded rows sit at the end; move them to the eviction end of the LRU
+        self.cache = OrderedDict(reversed(self.cache.items()))
+        logger.info(f"Preloaded {len(self.cache)} {self.table} names.")
+        return self
+
+    def _remember(self, name, row_id):
+        self.cache[name] = row_id
+        self.cache.move_to_end(name)
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def _upsert(self, names):
+        """Insert missing names and return name->ID for every name given."""
+        resolved = {}
+        cursor = self.connection.cursor()
+        for start in range(0, len(names), UPSERT_CHUNK_SIZE):
+            chunk = names[start:start + UPSERT_CHUNK_SIZE]
+            placeholders = ', '.join('(?)' for _ in chunk)
+            if SUPPORTS_RETURNING:
+                # The no-op DO UPDATE makes RETURNING report rows that already existed too
+                cursor.execute(f"""
+                    INSERT INTO {self.table} ({self.name_column}) VALUES {placeholders}
+                    ON CONFLICT({self.name_column}) DO UPDATE SET {self.name_column} = excluded.{self.name_column}
+                    RETURNING {self.name_column}, {self.id_column}
+                """, chunk)
+                resolved.update(cursor.fetchall())
+            else:
+                cursor.execute(f"INSERT OR IGNORE INTO {self.table} ({self.name_column}) VALUES {placeholders}", chunk)
+                cursor.execute(f"""
+                    SELECT {self.name_column}, {self.id_column} FROM {self.table}
+                    WHERE {self.name_column} IN ({', '.join('?' for _ in chunk)})
+                """, chunk)
+                resolved.update(cursor.fetchall())
+        with metrics.timer('db_commit'):
+            self.connection.commit()
+        return resolved
+
+    def resolve(self, names):
+        """Return the IDs for ``names`` (in order), creating rows for unseen names."""
+        missing = []
+        seen = set()
+        for name in names:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+            elif name not in seen:
+                seen.add(name)
+                missing.append(name)
+
+        metrics.increment('intern_lookups_total', len(names), table=self.table)
+        if missing:
+            metrics.increment('intern_misses_total', len(missing), table=self.table)
+            resolved = self._upsert(missing)
+        else:
+            resolved = {}
+
+        ids = []
+        for name in names:
+            row_id = resolved[name] if name in resolved else self.cache[name]
+            ids.append(row_id)
+        for name, row_id in resolved.items():
+            self._remember(name, row_id)
+        return ids
+
+# One interner per (database file, table), since IDs are only meaningful within a database
+_interners = {}
+# table -> (connection, interner) of the last lookup, so the per-row calls on one
+# connection are a dict lookup instead of a PRAGMA database_list round trip
+_current = {}
+
+def database_key(connection):
+    """Identify the database a connection points at (in-memory databases by connection)."""
+    path = connection.execute("PRAGMA database_list").fetchone()[2]
+    return path or f"memory:{id(connection)}"
+
+def get_interner(connection, table):
+    """Return the preloaded interner for ``table`` in the connection's database."""
+    current = _current.get(table)
+    # Holding the connection in _current keeps its id from being reused by a new one
+    if current is not None and current[0] is connection:
+        return current[1]
+    key = (database_key(connection), table)
+    interner = _interners.get(key)
+    if interner is None:
+        interner = _interners[key] = NameInterner(connection, table).preload()
+    else:
+        # A new connection to a known database keeps the already warm cache
+        interner.connection = connection
+    _current[table] = (connection, interner)
+    return interner
+
+def reset_interners():
+    """Forget all cached IDs; create_database calls this after dropping the tables."""
+    _interners.clear()
+    _current.clear()
@@ -0,0 +1,197 @@
+import argparse
+import logging
+import sqlite3
+from api_utils import (
+    fetch_paper_details_batch,
+    fetch_author_details_batch,
+    S2_BATCH_SIZE
+)
+from db_utils import ensure_last_fetched_columns, upsert_changed_columns
+from config import DATABASE_PATH
+from logging_config import setup_logging
+import metrics
+
+# Apply centralized logging setup
+setup_logging()
+logger = logging.getLogger(__name__)
+
+PAPER_REFRESH_FIELDS = 'citationCount,influentialCitationCount,referenceCount'
+AUTHOR_BATCH_SIZE = 500
+
+# ORDER BY clauses for choosing what to refresh first; never-fetched rows always lead
+PAPER_POLICIES = {
+    'stalest': "last_fetched ASC",
+    'recent': "year DESC, last_fetched ASC",
+    # Citations gained per day between the last two fetches; rows fetched only once sort
+    # after every row with a measured growth (NULLs are last in DESC order)
+    'fast_growing': "(citation_count - previous_citation_count) * 1.0"
+                    " / MAX(1, julianday(last_fetched) - julianday(previous_fetched)) DESC, last_fetched ASC",
+}
+AUTHOR_POLICIES = {
+    'stalest': "a.last_fetched ASC",
+    'recent': "(SELECT MAX(p.year) FROM Authorship s JOIN Papers p ON p.doi = s.doi WHERE s.author_id = a.author_id) DESC",
+    'fast_growing': "(a.citationCount - a.previous_citation_count) * 1.0"
+                    " / MAX(1, julianday(a.last_fetched) - julianday(a.previous_fetched)) DESC, a.last_fetched ASC",
+}
+
+# Raw count columns refresh overwrites; pre_numeric writes its normalised copies to *_norm
+PAPER_COUNT_COLUMNS = ('citation_count', 'reference_count', 'influential_citation_count')
+AUTHOR_COUNT_COLUMNS = ('paperCount', 'citationCount', 'hIndex')
+# Table -> (key column, citation count column) for the growth policy
+GROWTH_COLUMNS = {'Papers': ('doi', 'citation_count'), 'Authors': ('author_id', 'citationCount')}
+
+def is_normalized(connection, table, columns):
+    """True if the raw columns were normalised in place, as pre_numeric used to do.
+
+    Raw S2 counts are integers; such databases need re-ingesting before refresh can mix
+    new raw counts into them.
+    """
+    conditions = ' OR '.join(f"typeof({column}) = 'real'" for column in columns)
+    return connection.execute(f"SELECT EXISTS(SELECT 1 FROM {table} WHERE {conditions})").fetchone()[0] == 1
+
+def ensure_growth_columns(connection):
+    """Add the columns holding the citation count and time of the previous fetch."""
+    for table in GROWTH_COLUMNS:
+        columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        if 'previous_citation_count' not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN previous_citation_count INTEGER")
+        if 'previous_fetched' not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN previous_fetched TEXT")
+    connection.commit()
+
+def remember_previous_fetch(connection, table, keys):
+    """Keep the current citation count and fetch time of ``keys`` before they are overwritten."""
+    key_column, count_column = GROWTH_COLUMNS[table]
+    connection.executemany(f"""
+        UPDATE {table} SET previous_citation_count = {count_column}, previous_fetched = last_fetched
+        WHERE {key_column} = ? AND last_fetched IS NOT NULL
+    """, [(key,) for key in keys])
+
+def select_paper_candidates(connection, policy, limit, min_age_days):
+    """Pick papers not fetched within ``min_age_days``, ordered by the refresh policy."""
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT doi FROM Papers
+        WHERE last_fetched IS NULL OR last_fetched < datetime('now', ?)
+        ORDER BY last_fetched IS NOT NULL, {PAPER_POLICIES[policy]}
+        LIMIT ?
+    """, (f"-{min_age_days} days", limit))
+    return [row[0] for row in cursor.fetchall()]
+
+def select_author_candidates(connection, policy, limit, min_age_days):
+    """Pick authors not fetched within ``min_age_days``, ordered by the refresh policy."""
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT a.author_id FROM Authors a
+        WHERE a.last_fetched IS NULL OR a.last_fetched < datetime('now', ?)
+        ORDER BY a.last_fetched IS NOT NULL, {AUTHOR_POLICIES[policy]}
+        LIMIT ?
+    """, (f"-{min_age_days} days", limit))
+    return [row[0] for row in cursor.fetchall()]
+
+def refresh_papers(connection, policy='stalest', request_budget=10, min_age_days=30, batch_size=S2_BATCH_SIZE):
+    """Re-fetch citation metrics for the highest-priority stale papers within a request budget."""
+    dois = select_paper_candidates(connection, policy, request_budget * batch_size, min_age_days)
+    requests_used = 0
+    refreshed = changed = 0
+
+    for start in range(0, len(dois), batch_size):
+        batch = dois[start:start + batch_size]
+        paper_details, error_message = fetch_paper_details_batch(
+            batch, include_references=False, fields=PAPER_REFRESH_FIELDS)
+        requests_used += 1
+        if not paper_details:
+            logger.error(f"Paper refresh batch failed: {error_message}")
+            continue
+        rows = [
+            {
+                'doi': doi,
+                'citation_count': paper_data.get('citationCount'),
+                'influential_citation_count': paper_data.get('influentialCitationCount'),
+                'reference_count': paper_data.get('referenceCount'),
+            }
+            for doi, paper_data in zip(batch, paper_details) if paper_data
+        ]
+        remember_previous_fetch(connection, 'Papers', [row['doi'] for row in rows])
+        changed += upsert_changed_columns('Papers', 'doi', rows, connection)
+        refreshed += len(rows)
+
+    metrics.increment('refresh_rows_total', refreshed, table='Papers')
+    metrics.increment('refresh_changed_rows_total', changed, table='Papers')
+    logger.info(f"Refreshed {refreshed} papers ({changed} changed) with {requests_used} requests, policy={policy}.")
+    return requests_used
+
+def refresh_authors(connection, policy='stalest', request_budget=10, min_age_days=30, batch_size=AUTHOR_BATCH_SIZE):
+    """Re-fetch paper/citation counts and h-index for the highest-priority stale authors."""
+    author_ids = select_author_candidates(connection, policy, request_budget * batch_size, min_age_days)
+    requests_used = 0
+    refreshed = changed = 0
+
+    for start in range(0, len(author_ids), batch_size):
+        batch = author_ids[start:start + batch_size]
+        author_details, error_message = fetch_author_details_batch(batch)
+        requests_used += 1
+        if not author_details:
+            logger.error(f"Author refresh batch failed: {error_message}")
+            continue
+        rows = [
+            {
+                'author_id': author_id,
+                'name': author.get('name'),
+                'paperCount': author.get('paperCount'),
+                'citationCount': author.get('citationCount'),
+                'hIndex': author.get('hIndex'),
+            }
+            for author_id, author in zip(batch, author_details) if author
+        ]
+        remember_previous_fetch(connection, 'Authors', [row['author_id'] for row in rows])
+        changed += upsert_changed_columns('Authors', 'author_id', rows, connection)
+        refreshed += len(rows)
+
+    metrics.increment('refresh_rows_total', refreshed, table='Authors')
+    metrics.increment('refresh_changed_rows_total', changed, table='Authors')
+    logger.info(f"Refreshed {refreshed} authors ({changed} changed) with {requests_used} requests, policy={policy}.")
+    return requests_used
+
+def refresh(connection, target='both', policy='stalest', request_budget=20, min_age_days=30):
+    """Spend the request budget on papers first, then authors when refreshing both.
+
+    Refresh writes the raw S2 counts; pre_numeric keeps its normalised values in separate
+    *_norm columns, so rerun the numeric stage afterwards to bring those up to date.
+    Tables whose raw counts were normalised in place by an older pre_numeric are skipped
+    rather than mixing scales.
+    """
+    ensure_last_fetched_columns(connection)
+    ensure_growth_columns(connection)
+    used = 0
+    if target in ('papers', 'both') and is_normalized(connection, 'Papers', PAPER_COUNT_COLUMNS):
+        logger.error("Papers counts were normalised in place; re-ingest them before refreshing. Skipping papers.")
+        target = 'authors' if target == 'both' else None
+    if target in ('authors', 'both') and is_normalized(connection, 'Authors', AUTHOR_COUNT_COLUMNS):
+        logger.error("Authors counts were normalised in place; re-ingest them before refreshing. Skipping authors.")
+        target = 'papers' if target == 'both' else None
+    if target in ('papers', 'both'):
+        paper_budget = request_budget if target == 'papers' else (request_budget + 1) // 2
+        used += refresh_papers(connection, policy, paper_budget, min_age_days)
+    if target in ('authors', 'both'):
+        used += refresh_authors(connection, policy, request_budget - used, min_age_days)
+    return used
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Refresh stale paper and author metrics from Semantic Scholar (rerun the numeric stage after).")
+    parser.add_argument('--target', choices=['papers', 'authors', 'both'], default='both')
+    parser.add_argument('--policy', choices=sorted(PAPER_POLICIES), default='stalest')
+    parser.add_argument('--budget', type=int, default=20, help="Maximum number of API requests")
+    parser.add_argument('--min-age-days', type=int, default=30, help="Only refresh rows fetched longer ago")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.start_exporter()
+    with sqlite3.connect(DATABASE_PATH) as connection:
+        used = refresh(connection, args.target, args.policy, args.budget, args.min_age_days)
+    logger.info(f"Refresh finished using {used} of {args.budget} requests.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+# Adjust sys.path before any other imports
+current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
+project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
+sys.path.insert(0, project_root)  # Add project root to the start of the search path
+sys.path.insert(1, os.path.join(project_root, 'build_db'))
+
+import api_main
+from api_utils import share_rate_limit
+from db_utils import ensure_last_fetched_columns
+from init_db import create_database, create_indexes
+from config import DATABASE_PATH, METRICS_FILE
+from logging_config import setup_logging, shutdown_logging
+import metrics
+
+# Apply centralized logging setup
+setup_logging()
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = 'data/shards'
+
+PAPER_COLUMNS = ['doi', 'paper_id', 'title', 'title_embedding', 'year', 'citation_count', 'reference_count',
+                 'influential_citation_count', 'embedding', 'last_fetched']
+AUTHOR_COLUMNS = ['author_id', 'name', 'paperCount', 'citationCount', 'hIndex', 'last_fetched']
+
+def shard_of(doi, n_shards):
+    """Stable shard number for a DOI (Python's hash() is salted per process)."""
+    return int(hashlib.md5(doi.strip().lower().encode()).hexdigest(), 16) % n_shards
+
+def shard_path(index, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f"shard_{index:03d}.db")
+
+def shard_metrics_path(index):
+    """Per-worker metrics file next to METRICS_FILE, e.g. logs/metrics_shard_003.prom."""
+    root, extension = os.path.splitext(METRICS_FILE)
+    return f"{root}_shard_{index:03d}{extension}"
+
+def ingest_shard(index, n_shards, one_pass, next_request_slot=None, shard_dir=SHARD_DIR):
+    """Worker entry point: ingest one DOI-hash partition into its own shard database."""
+    # The forked registry still holds the parent's metrics; report only this worker's
+    metrics.reset()
+    if next_request_slot is not None:
+        share_rate_limit(next_request_slot)
+    try:
+        doi_keywords = api_main.load_dois_and_keywords()
+        partition = doi_keywords[doi_keywords['DOI'].map(lambda doi: shard_of(doi, n_shards) == index)]
+        path = shard_path(index, shard_dir)
+        logger.info(f"Shard {index}/{n_shards}: ingesting {len(partition)} DOIs into {path}")
+
+        connection = create_database(path)
+        try:
+            if one_pass:
+                corpus_dois = {doi.strip().lower(): doi for doi in doi_keywords['DOI']}
+                api_main.process_papers_one_pass(connection, doi_keywords=partition, corpus_dois=corpus_dois)
+            else:
+                api_main.process_papers(connection, doi_keywords=partition)
+        finally:
+            connection.close()
+        # Only shards with a completion marker are merged
+        open(f"{path}.done", 'w').close()
+    finally:
+        # Worker processes exit without running atexit hooks, so write metrics and flush
+        # the log queue here
+        metrics.write_snapshot(shard_metrics_path(index))
+        shutdown_logging()
+
+def run_workers(n_shards, shards, one_pass, shard_dir=SHARD_DIR):
+    """Run one process per shard and report which shards finished successfully.
+
+    A separate process per shard means a worker that crashes outright only loses its
+    own partition; the other shards still complete and can be merged.  All workers share
+    one API key, so they draw S2 requests from a single shared rate budget; extra workers
+    parallelize parsing and inserts, not the request rate.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    next_request_slot = multiprocessing.Value('d', 0.0)
+    processes = {}
+    for index in shards:
+        done_marker = f"{shard_path(index, shard_dir)}.done"
+        if os.path.exists(done_marker):
+            os.remove(done_marker)
+        process = multiprocessing.Process(
+            target=ingest_shard, args=(index, n_shards, one_pass, next_request_slot, shard_dir), name=f"shard-{index}")
+        process.start()
+        processes[index] = process
+
+    succeeded, failed = [], []
+    for index, process in processes.items():
+        process.join()
+        if process.exitcode == 0 and os.path.exists(f"{shard_path(index, shard_dir)}.done"):
+            succeeded.append(index)
+        else:
+            logger.error(f"Shard {index} failed with exit code {process.exitcode}; rerun it with --shards {index}")
+            failed.append(index)
+    return succeeded, failed
+
+def merge_shard(connection, path):
+    """Fold one shard into the main database with set-based INSERT ... SELECT statements.
+
+    Journal and keyword integer IDs are local to each shard, so rows referencing them
+    are re-keyed by joining through the journal name / keyword text.  Citation edges
+    are merged afterwards by merge_shard_citations.
+    """
+    cursor = connection.cursor()
+    cursor.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("INSERT OR IGNORE INTO main.Journals (name) SELECT name FROM shard.Journals")
+        cursor.execute("""
+            INSERT OR IGNORE INTO main.Keywords (keyword, embedding)
+            SELECT keyword, embedding FROM shard.Keywords
+        """)
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO main.Authors ({', '.join(AUTHOR_COLUMNS)})
+            SELECT {', '.join(AUTHOR_COLUMNS)} FROM shard.Authors
+        """)
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO main.Papers ({', '.join(PAPER_COLUMNS)}, journal_id)
+            SELECT {', '.join('p.' + column for column in PAPER_COLUMNS)}, mj.journal_id
+            FROM shard.Papers p
+            LEFT JOIN shard.Journals sj ON sj.journal_id = p.journal_id
+            LEFT JOIN main.Journals mj ON mj.name = sj.name
+        """)
+        cursor.execute("""
+            INSERT INTO main.Authorship (author_id, doi)
+            SELECT DISTINCT sa.author_id, sa.doi FROM shard.Authorship sa
+            WHERE NOT EXISTS (
+                SELECT 1 FROM main.Authorship ma WHERE ma.doi = sa.doi AND ma.author_id = sa.author_id
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO main.PaperKeywords (paper_id, keyword_id)
+            SELECT DISTINCT spk.paper_id, mk.id
+            FROM shard.PaperKeywords spk
+            JOIN shard.Keywords sk ON sk.id = spk.keyword_id
+            JOIN main.Keywords mk ON mk.keyword = sk.keyword
+            WHERE NOT EXISTS (
+                SELECT 1 FROM main.PaperKeywords mpk WHERE mpk.paper_id = spk.paper_id AND mpk.keyword_id = mk.id
+            )
+        """)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("DETACH DATABASE shard")
+
+def merge_shard_citations(connection, path):
+    """Copy a shard's citation edges whose both papers are in the main database.
+
+    One-pass shards keep edges to papers of other shards, so this runs after every
+    shard's papers are merged; edges to papers that no shard ingested are dropped.
+    """
+    cursor = connection.cursor()
+    cursor.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        cursor.execute("""
+            INSERT INTO main.Citations (citing_doi, cited_doi)
+            SELECT DISTINCT sc.citing_doi, sc.cited_doi FROM shard.Citations sc
+            WHERE EXISTS (SELECT 1 FROM main.Papers p WHERE p.doi = sc.citing_doi)
+              AND EXISTS (SELECT 1 FROM main.Papers p WHERE p.doi = sc.cited_doi)
+              AND NOT EXISTS (
+                SELECT 1 FROM main.Citations mc WHERE mc.citing_doi = sc.citing_doi AND mc.cited_doi = sc.cited_doi
+            )
+        """)
+        return cursor.rowcount
+    finally:
+        cursor.execute("DETACH DATABASE shard")
+
+def completed_shards(shard_dir=SHARD_DIR):
+    """Indices of every shard in ``shard_dir`` with a completion marker."""
+    return sorted(int(name[len('shard_'):-len('.db.done')]) for name in os.listdir(shard_dir)
+                  if name.startswith('shard_') and name.endswith('.db.done'))
+
+def merge_shards(shards, db_path=DATABASE_PATH, shard_dir=SHARD_DIR):
+    """Merge completed shards into the main database; a failing shard does not stop the rest."""
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    merged = []
+    try:
+        ensure_last_fetched_columns(connection)
+        # The NOT EXISTS dedupe needs these indexes to stay linear
+        create_indexes(connection)
+        for index in shards:
+            path = shard_path(index, shard_dir)
+            if not os.path.exists(f"{path}.done"):
+                logger.warning(f"Shard {index} has no completion marker, not merging it.")
+                continue
+            try:
+                with metrics.timer('shard_merge', shard=index):
+                    merge_shard(connection, path)
+                merged.append(index)
+                logger.info(f"Merged shard {index} from {path}")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to merge shard {index}: {e}")
+        # Edges between shards resolve only once both papers are merged, so every completed
+        # shard is revisited, including ones merged by an earlier run
+        for index in completed_shards(shard_dir):
+            try:
+                with metrics.timer('shard_merge_citations', shard=index):
+                    added = merge_shard_citations(connection, shard_path(index, shard_dir))
+                logger.info(f"Merged {added} citation edges from shard {index}")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to merge citations of shard {index}: {e}")
+        for table in ('Papers', 'Authors', 'Citations', 'Journals', 'Keywords', 'PaperKeywords'):
+            api_main.count_rows(table, connection)
+    finally:
+        connection.close()
+    return merged
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest papers in parallel shards and merge them.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of shards / worker processes (keep it fixed when rerunning shards); "
+                             "workers share one S2 rate budget of S2_REQUEST_INTERVAL")
+    parser.add_argument('--shards', type=int, nargs='+', help="Only (re)run these shard numbers")
+    parser.add_argument('--one-pass', action='store_true', help="Ingest citation edges from S2 references")
+    parser.add_argument('--merge-only', action='store_true', help="Merge existing shards without ingesting")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.start_exporter()
+    shards = args.shards if args.shards is not None else list(range(args.workers))
+    failed = []
+    if not args.merge_only:
+        _, failed = run_workers(args.workers, shards, args.one_pass)
+    merged = merge_shards(shards)
+    logger.info(f"Merged shards {merged}; failed shards {failed}.")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,12 +6,16 @@ import os
 current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
 project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
 sys.path.insert(0, project_root)  # Add project root to the start of the search path
+sys.path.insert(1, os.path.join(project_root, 'api'))
 
 from config import DATABASE_PATH
+from interning import reset_interners
 
-def create_database():
-    conn = sqlite3.connect(DATABASE_PATH)
+def create_database(db_path=DATABASE_PATH):
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
+    # WAL lets the query service read while ingestion writes; the mode is stored in the file
+    c.execute('PRAGMA journal_mode = WAL')
 
     # Drop tables if they exist to avoid conflicts
     c.execute('DROP TABLE IF EXISTS Journals')
@@ -21,6 +25,8 @@ def create_database():
     c.execute('DROP TABLE IF EXISTS Citations')
     c.execute('DROP TABLE IF EXISTS Keywords')
     c.execute('DROP TABLE IF EXISTS PaperKeywords')
+    # Cached journal/keyword IDs belong to the dropped tables
+    reset_interners()
     
     # Create Journals Table
     c.execute('''
@@ -37,7 +43,8 @@ def create_database():
             name TEXT,
             paperCount INT,
             citationCount INT,
-            hIndex INT
+            hIndex INT,
+            last_fetched TEXT
         )
     ''')
 
@@ -54,6 +61,7 @@ def create_database():
             influential_citation_count INTEGER,
             journal_id INTEGER,
             embedding TEXT,
+            last_fetched TEXT,
             FOREIGN KEY (journal_id) REFERENCES Journals(journal_id)
         )
     ''')
@@ -98,9 +106,21 @@ def create_database():
         )
     ''')
 
+    create_indexes(conn)
     conn.commit()
     return conn
 
+def create_indexes(conn):
+    """Index the edge tables so joins, dedupe and neighbourhood lookups avoid full scans."""
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS idx_authorship_doi ON Authorship (doi, author_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_authorship_author ON Authorship (author_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_citations_citing ON Citations (citing_doi, cited_doi)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_citations_cited ON Citations (cited_doi)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_paperkeywords_paper ON PaperKeywords (paper_id, keyword_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_paperkeywords_keyword ON PaperKeywords (keyword_id)')
+    conn.commit()
+
 # Call the function to create the database and tables
 if __name__ == '__main__':
     conn = create_database()
@@ -2,71 +2,210 @@ import pandas as pd
 import torch
 from torch_geometric.data import HeteroData
 import sqlite3
-import json
+import os
+import sys
 
-from config import DATABASE_PATH
+# Adjust sys.path before any other imports
+current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
+project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
+sys.path.insert(0, project_root)  # Add project root to the start of the search path
+sys.path.insert(1, os.path.join(project_root, 'feature_enginnering'))
+
+from config import DATABASE_PATH, USE_COMPACT_FEATURES, LABEL_CUTOFF_YEAR
+from feature_db_utils import parse_vector, NORMALIZED_SUFFIX
+import metrics
+
+TABLES = ['Papers', 'Authors', 'Keywords', 'Authorship', 'Citations', 'PaperKeywords', 'Journals']
 
 # Function to load data from a specific table
 def load_data_from_db(table_name, connection):
     query = f"SELECT * FROM {table_name}"
     return pd.read_sql_query(query, connection)
 
-# Connect to the database
-conn = sqlite3.connect(DATABASE_PATH)
-
-# Load data
-papers_df = load_data_from_db('Papers', conn)
-authors_df = load_data_from_db('Authors', conn)
-keywords_df = load_data_from_db('Keywords', conn)
-authorship_df = load_data_from_db('Authorship', conn)
-citations_df = load_data_from_db('Citations', conn)
-paper_keywords_df = load_data_from_db('PaperKeywords', conn)
-journals_df = load_data_from_db('Journals', conn)
-
-# Initialize the HeteroData object
-data = HeteroData()
-
-# Add nodes for Papers
-paper_features = papers_df[['citation_count', 'reference_count', 'influential_citation_count', 'embedding', 'title_embedding']].applymap(json.loads)
-data['paper'].x = torch.tensor(paper_features.values.tolist(), dtype=torch.float)
-data['paper'].node_id = torch.tensor(papers_df['doi'].values, dtype=torch.long)
-
-# Add nodes for Authors
-author_features = authors_df[['paperCount', 'citationCount', 'hIndex']].astype(float)
-data['author'].x = torch.tensor(author_features.values.tolist(), dtype=torch.float)
-data['author'].node_id = torch.tensor(authors_df['author_id'].values, dtype=torch.long)
-
-# Add nodes for Keywords
-keyword_features = keywords_df[['embedding']].applymap(json.loads)
-data['keyword'].x = torch.tensor(keyword_features.values.tolist(), dtype=torch.float)
-data['keyword'].node_id = torch.tensor(keywords_df['id'].values, dtype=torch.long)
-
-# Add nodes for Journals
-journal_features = pd.factorize(journals_df['name'])[0]
-data['journal'].x = torch.tensor(journal_features, dtype=torch.long).unsqueeze(1)
-data['journal'].node_id = torch.tensor(journals_df['journal_id'].values, dtype=torch.long)
-
-# Add edges for Authorship (paper <-> author)
-source_author = authorship_df['author_id'].values
-target_paper = authorship_df['doi'].values
-data['author', 'writes', 'paper'].edge_index = torch.tensor([source_author, target_paper], dtype=torch.long)
-
-# Add edges for Citations (paper -> paper)
-source_cite = citations_df['citing_doi'].values
-target_cite = citations_df['cited_doi'].values
-data['paper', 'cites', 'paper'].edge_index = torch.tensor([source_cite, target_cite], dtype=torch.long)
-
-# Add edges for PaperKeywords (paper <-> keyword)
-source_keyword = paper_keywords_df['paper_id'].values
-target_keyword = paper_keywords_df['keyword_id'].values
-data['paper', 'has', 'keyword'].edge_index = torch.tensor([source_keyword, target_keyword], dtype=torch.long)
-
-# Add edges for Journals (journal <-> paper)
-source_journal = papers_df['journal_id'].values
-target_journal = papers_df['doi'].values
-data['journal', 'publishes', 'paper'].edge_index = torch.tensor([source_journal, target_journal], dtype=torch.long)
-
-# Verify the structure of the heterogeneous data object
-print(data)
-
-conn.close()
+def load_tables(connection):
+    """Load every table the graph is built from into a dict of DataFrames."""
+    tables = {}
+    for table in TABLES:
+        with metrics.timer('graph_build_phase', phase=f"load_{table}"):
+            tables[table] = load_data_from_db(table, connection)
+    return tables
+
+def load_labels(connection, tables, version=None, cutoff_year=LABEL_CUTOFF_YEAR):
+    """Add the paper and keyword labels of one version and cutoff to ``tables``, if built."""
+    from impact_labels import label_version
+
+    version = version or label_version()
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'PaperLabels'").fetchone()
+    if not exists:
+        return None
+    if cutoff_year is None:
+        cutoff_year = connection.execute(
+            "SELECT MAX(cutoff_year) FROM PaperLabels WHERE version = ?", (version,)).fetchone()[0]
+        if cutoff_year is None:
+            return None
+    with metrics.timer('graph_build_phase', phase='load_labels'):
+        tables['PaperLabels'] = pd.read_sql_query(
+            "SELECT * FROM PaperLabels WHERE version = ? AND cutoff_year = ?", connection, params=(version, cutoff_year))
+        tables['KeywordLabels'] = pd.read_sql_query(
+            "SELECT * FROM KeywordLabels WHERE version = ? AND cutoff_year = ?", connection, params=(version, cutoff_year))
+    return cutoff_year
+
+def align_labels(keys, labels_df, key_column, columns):
+    """Left-join label columns onto node order; returns the values and a mask of labelled nodes."""
+    aligned = pd.DataFrame({key_column: keys}).merge(labels_df[[key_column] + columns], on=key_column, how='left')
+    mask = torch.tensor(aligned[columns[0]].notna().values, dtype=torch.bool)
+    return aligned[columns].fillna(0).astype(float), mask
+
+def count_features(df, columns):
+    """Count columns as floats, preferring the normalised copies written by pre_numeric."""
+    columns = [column + NORMALIZED_SUFFIX if column + NORMALIZED_SUFFIX in df.columns else column
+               for column in columns]
+    return df[columns].fillna(0).astype(float)
+
+def stack_vectors(series):
+    """Stack a column of JSON vectors into one dense matrix, zero-padding missing rows."""
+    vectors = [parse_vector(value) or [] for value in series]
+    width = max((len(vector) for vector in vectors), default=0)
+    matrix = torch.zeros((len(vectors), width), dtype=torch.float)
+    for row, vector in enumerate(vectors):
+        if vector:
+            matrix[row, :len(vector)] = torch.tensor(vector, dtype=torch.float)
+    return matrix
+
+def compact_matrix(keys, feature):
+    """Align a compressed float16 feature matrix with node order, zero-filling missing rows."""
+    from compress_features import load_compact_features
+
+    ids, matrix = load_compact_features(feature)
+    position = {key: row for row, key in enumerate(ids.tolist())}
+    compact = torch.zeros((len(keys), matrix.shape[1]), dtype=torch.float16)
+    rows = [(node, position[key]) for node, key in enumerate(keys) if key in position]
+    if rows:
+        nodes, source_rows = zip(*rows)
+        compact[list(nodes)] = torch.from_numpy(matrix[list(source_rows)])
+    return compact
+
+def index_edges(source_values, target_values, source_index, target_index):
+    """Map raw edge endpoints to node positions, dropping edges to unknown nodes."""
+    pairs = [
+        (source_index[source], target_index[target])
+        for source, target in zip(source_values, target_values)
+        if source in source_index and target in target_index
+    ]
+    if not pairs:
+        return torch.empty((2, 0), dtype=torch.long)
+    return torch.tensor(pairs, dtype=torch.long).t().contiguous()
+
+def build_graph(tables, compact=USE_COMPACT_FEATURES):
+    """Build the heterogeneous paper/author/keyword/journal graph from loaded tables.
+
+    With ``compact`` the embeddings come from the reduced float16 matrices written by
+    compress_features instead of the full float32 vectors stored in the database, and stay
+    float16 in the graph: paper ``x`` holds only the float32 counts, next to float16
+    ``embedding`` and ``title_embedding`` attributes, and keyword ``x`` is float16.  Cast
+    them per batch (``.float()``) where a model needs float32 inputs.
+    """
+    papers_df = tables['Papers']
+    authors_df = tables['Authors']
+    keywords_df = tables['Keywords']
+    authorship_df = tables['Authorship']
+    citations_df = tables['Citations']
+    paper_keywords_df = tables['PaperKeywords']
+    journals_df = tables['Journals']
+
+    # Node positions keyed by the identifiers used in the edge tables
+    paper_index = {doi: i for i, doi in enumerate(papers_df['doi'])}
+    author_index = {author_id: i for i, author_id in enumerate(authors_df['author_id'])}
+    keyword_index = {keyword_id: i for i, keyword_id in enumerate(keywords_df['id'])}
+    journal_index = {journal_id: i for i, journal_id in enumerate(journals_df['journal_id'])}
+
+    # Initialize the HeteroData object
+    data = HeteroData()
+
+    # Add nodes for Papers
+    with metrics.timer('graph_build_phase', phase='paper_nodes'):
+        paper_counts = count_features(papers_df, ['citation_count', 'reference_count', 'influential_citation_count'])
+        if compact:
+            dois = papers_df['doi'].tolist()
+            # Raw counts exceed float16's exact-integer (2048) and finite (65504) range, so
+            # they stay float32 in x and only the projected embeddings are float16
+            data['paper'].x = torch.tensor(paper_counts.values, dtype=torch.float)
+            data['paper'].embedding = compact_matrix(dois, 'paper_embedding')
+            data['paper'].title_embedding = compact_matrix(dois, 'paper_title_embedding')
+        else:
+            data['paper'].x = torch.cat([
+                torch.tensor(paper_counts.values, dtype=torch.float),
+                stack_vectors(papers_df['embedding']),
+                stack_vectors(papers_df['title_embedding'])
+            ], dim=1)
+        data['paper'].node_id = torch.arange(len(papers_df), dtype=torch.long)
+
+    # Add nodes for Authors
+    with metrics.timer('graph_build_phase', phase='author_nodes'):
+        author_features = count_features(authors_df, ['paperCount', 'citationCount', 'hIndex'])
+        data['author'].x = torch.tensor(author_features.values, dtype=torch.float)
+        data['author'].node_id = torch.arange(len(authors_df), dtype=torch.long)
+
+    # Add nodes for Keywords
+    with metrics.timer('graph_build_phase', phase='keyword_nodes'):
+        if compact:
+            data['keyword'].x = compact_matrix(keywords_df['id'].tolist(), 'keyword_embedding')
+        else:
+            data['keyword'].x = stack_vectors(keywords_df['embedding'])
+        data['keyword'].node_id = torch.tensor(keywords_df['id'].values, dtype=torch.long)
+
+    # Add nodes for Journals
+    with metrics.timer('graph_build_phase', phase='journal_nodes'):
+        journal_features = pd.factorize(journals_df['name'])[0]
+        data['journal'].x = torch.tensor(journal_features, dtype=torch.long).unsqueeze(1)
+        data['journal'].node_id = torch.tensor(journals_df['journal_id'].values, dtype=torch.long)
+
+    with metrics.timer('graph_build_phase', phase='edges'):
+        # Add edges for Authorship (paper <-> author)
+        data['author', 'writes', 'paper'].edge_index = index_edges(
+            authorship_df['author_id'].values, authorship_df['doi'].values, author_index, paper_index)
+
+        # Add edges for Citations (paper -> paper)
+        data['paper', 'cites', 'paper'].edge_index = index_edges(
+            citations_df['citing_doi'].values, citations_df['cited_doi'].values, paper_index, paper_index)
+
+        # Add edges for PaperKeywords (paper <-> keyword)
+        data['paper', 'has', 'keyword'].edge_index = index_edges(
+            paper_keywords_df['paper_id'].values, paper_keywords_df['keyword_id'].values, paper_index, keyword_index)
+
+        # Add edges for Journals (journal <-> paper)
+        data['journal', 'publishes', 'paper'].edge_index = index_edges(
+            papers_df['journal_id'].values, papers_df['doi'].values, journal_index, paper_index)
+
+    # Targets from impact_labels; nodes published after the cutoff stay unlabelled
+    if 'PaperLabels' in tables:
+        with metrics.timer('graph_build_phase', phase='labels'):
+            paper_labels, data['paper'].label_mask = align_labels(
+                papers_df['doi'], tables['PaperLabels'], 'doi', ['future_citations', 'top_in_year', 'top_in_journal_year'])
+            data['paper'].y = torch.tensor(paper_labels['future_citations'].values, dtype=torch.float)
+            data['paper'].y_top = torch.tensor(paper_labels[['top_in_year', 'top_in_journal_year']].values, dtype=torch.bool)
+            keyword_labels, data['keyword'].label_mask = align_labels(
+                keywords_df['id'], tables['KeywordLabels'], 'keyword_id', ['growth', 'top_growth'])
+            data['keyword'].y = torch.tensor(keyword_labels['growth'].values, dtype=torch.float)
+            data['keyword'].y_top = torch.tensor(keyword_labels['top_growth'].values, dtype=torch.bool)
+
+    return data
+
+def main(db_path=DATABASE_PATH, compact=USE_COMPACT_FEATURES):
+    metrics.start_exporter()
+    # Connect to the database
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = load_tables(conn)
+        load_labels(conn, tables)
+        data = build_graph(tables, compact)
+    finally:
+        conn.close()
+
+    # Verify the structure of the heterogeneous data object
+    print(data)
+    return data
+
+if __name__ == '__main__':
+    main()
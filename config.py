@@ -1,4 +1,49 @@
 # Configuration for the project
 DATABASE_PATH = 'data/project_data.db'
 LOG_FILE = 'logs/application.log'
-FILE_PATH =  'data/preprocessed.csv'
\ No newline at end of file
+LOG_LEVEL = 'INFO'  # Root level, overridable with the LOG_LEVEL environment variable
+# Per-module levels keyed by logger name, e.g. {'db_utils': 'DEBUG'}; extend with LOG_LEVELS="db_utils=DEBUG,..."
+LOG_LEVELS = {}
+LOG_SAMPLE_EVERY = 1000  # Emit one in N per-row log events
+LOG_PROGRESS_INTERVAL = 30  # Seconds between progress lines of long loops
+FILE_PATH =  'data/preprocessed.csv'
+INTERN_CACHE_SIZE = 100000  # Max cached journal/keyword name->ID pairs per table
+S2_REQUEST_INTERVAL = 1.1  # Minimum seconds between Semantic Scholar requests, across all shard workers
+
+# Run write-heavy stages against an in-memory copy of the database (or set BIBLIO_IN_MEMORY=1)
+IN_MEMORY_DB = False
+SNAPSHOT_INTERVAL = 300  # Seconds between durable snapshots of the in-memory database
+
+# Metrics export (format is 'prometheus' for a node_exporter textfile or 'json')
+METRICS_FILE = 'logs/metrics.prom'
+METRICS_FORMAT = 'prometheus'
+METRICS_INTERVAL = 30  # Seconds between snapshots
+
+# Compressed embedding features written by feature_enginnering/compress_features.py
+FEATURES_DIR = 'data/features'
+COMPRESSION_METHOD = 'pca'  # 'pca' or 'random' projection
+COMPRESSED_DIM = 64
+USE_COMPACT_FEATURES = False  # build_network uses the reduced float16 features when True
+
+# Future-impact labels written by feature_enginnering/impact_labels.py
+LABEL_HORIZON = 3  # Years after a cutoff in which citations are counted
+LABEL_TOP_PERCENT = 10  # Papers/keywords in this top percent of their group are flagged
+LABEL_CUTOFF_YEAR = None  # Cutoff joined onto the graph by build_network (None: latest available)
+
+# Keyword topic clustering (feature_enginnering/keyword_topics.py)
+TOPIC_COUNT = 2000  # Number of topics (mini-batch k-means clusters)
+TOPIC_BATCH_SIZE = 4096
+TOPIC_EPOCHS = 3  # Passes over the streamed keyword embeddings when fitting
+
+# Opt-in profiling (profiling.py); also enabled by BIBLIO_PROFILE=1 or pipeline.py --profile
+PROFILING = False
+PROFILE_DIR = 'logs/profiles'
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples for the flame graph
+PROFILE_TOP_N = 30  # Functions and allocation sites listed in each text report
+
+# Read-only query service (query_service.py)
+QUERY_SERVICE_HOST = '127.0.0.1'
+QUERY_SERVICE_PORT = 8765
+QUERY_POOL_SIZE = 4  # Read-only connections shared by request threads
+QUERY_CACHE_SIZE = 50000  # Cached per-key results (papers, embeddings, citation links, trends)
+QUERY_MAX_NODES = 10000  # Cap on papers returned by a neighbourhood expansion
@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import os
+import numpy as np
+import feature_db_utils
+import metrics
+from config import FEATURES_DIR, COMPRESSION_METHOD, COMPRESSED_DIM
+
+logger = logging.getLogger(__name__)
+
+# Embedding columns that can be compressed: name -> (table, key column, embedding column)
+FEATURE_SOURCES = {
+    'paper_embedding': ('Papers', 'doi', 'embedding'),
+    'paper_title_embedding': ('Papers', 'doi', 'title_embedding'),
+    'keyword_embedding': ('Keywords', 'id', 'embedding'),
+}
+
+def iter_chunks(feature, chunk_size=10000, connection=None, keep_fraction=1.0, rng=None):
+    """Yield (keys, float32 matrix) chunks for one feature source, skipping empty vectors.
+
+    With ``keep_fraction`` below 1 a random subset of rows is kept before the JSON is
+    decoded, so sampling also saves the parsing.
+    """
+    table, key_column, column = FEATURE_SOURCES[feature]
+    for rows in feature_db_utils.iter_embeddings(table, key_column, column, chunk_size, connection):
+        if keep_fraction < 1.0:
+            rows = [row for row, keep in zip(rows, rng.random(len(rows)) < keep_fraction) if keep]
+        keys, vectors = [], []
+        for key, value in rows:
+            vector = feature_db_utils.parse_vector(value)
+            if vector:
+                keys.append(key)
+                vectors.append(vector)
+        if vectors:
+            yield keys, np.asarray(vectors, dtype=np.float32)
+
+def fit_pca(feature, dim, fit_sample=None, seed=42):
+    """Fit PCA from streamed chunks by accumulating the covariance matrix.
+
+    Memory stays at one chunk plus a d x d matrix however many rows there are.  With
+    ``fit_sample`` only roughly that many randomly chosen rows are used.
+    """
+    rng = np.random.default_rng(seed)
+    keep_fraction = 1.0
+    if fit_sample is not None:
+        table, _, column = FEATURE_SOURCES[feature]
+        keep_fraction = min(1.0, fit_sample / max(feature_db_utils.count_embeddings(table, column), 1))
+    n = 0
+    total = gram = None
+    for _, matrix in iter_chunks(feature, keep_fraction=keep_fraction, rng=rng):
+        if total is None:
+            total = np.zeros(matrix.shape[1])
+            gram = np.zeros((matrix.shape[1], matrix.shape[1]))
+        matrix = matrix.astype(np.float64)
+        n += len(matrix)
+        total += matrix.sum(axis=0)
+        gram += matrix.T @ matrix
+    if not n:
+        raise ValueError(f"No {feature} vectors to fit")
+
+    mean = total / n
+    covariance = (gram - n * np.outer(mean, mean)) / max(n - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0, None)
+    components = eigenvectors[:, order[:dim]].T
+    return {
+        'mean': mean.astype(np.float32),
+        'components': components.astype(np.float32),
+        'explained_variance': eigenvalues[:dim].astype(np.float32),
+    }
+
+def fit_random_projection(feature, dim, seed=42):
+    """Gaussian random projection; needs only the input width, so no pass over the data."""
+    for _, matrix in iter_chunks(feature, chunk_size=1):
+        width = matrix.shape[1]
+        break
+    else:
+        raise ValueError(f"No {feature} vectors to fit")
+    rng = np.random.default_rng(seed)
+    components = rng.standard_normal((dim, width)).astype(np.float32) / np.sqrt(dim)
+    return {'mean': np.zeros(width, dtype=np.float32), 'components': components}
+
+def projection_path(feature, method, dim):
+    return os.path.join(FEATURES_DIR, f"{feature}_{method}{dim}.npz")
+
+def features_path(feature, method, dim):
+    return os.path.join(FEATURES_DIR, f"{feature}_{method}{dim}_features.npz")
+
+def compress_feature(feature, method=COMPRESSION_METHOD, dim=COMPRESSED_DIM, fit_sample=None):
+    """Fit a projection for one feature, persist it and write the reduced float16 matrix."""
+    os.makedirs(FEATURES_DIR, exist_ok=True)
+    with metrics.timer('compress_fit', feature=feature, method=method):
+        if method == 'pca':
+            projection = fit_pca(feature, dim, fit_sample)
+        elif method == 'random':
+            projection = fit_random_projection(feature, dim)
+        else:
+            raise ValueError(f"Unknown compression method: {method}")
+    np.savez(projection_path(feature, method, dim), **projection)
+
+    # Orthonormal basis of the projected subspace, used to measure the variance it keeps
+    basis = np.linalg.qr(projection['components'].T.astype(np.float64))[0]
+    keys, chunks = [], []
+    total_energy = retained_energy = 0.0
+    with metrics.timer('compress_transform', feature=feature, method=method):
+        for chunk_keys, matrix in iter_chunks(feature):
+            centered = matrix - projection['mean']
+            reduced = centered @ projection['components'].T
+            total_energy += float(np.square(centered, dtype=np.float64).sum())
+            retained_energy += float(np.square(centered @ basis).sum())
+            keys.extend(chunk_keys)
+            chunks.append(reduced.astype(np.float16))
+    if not chunks:
+        raise ValueError(f"No {feature} vectors to compress")
+    reduced = np.concatenate(chunks)
+    np.savez(features_path(feature, method, dim), ids=np.asarray(keys), matrix=reduced)
+
+    original_width = projection['components'].shape[1]
+    original_bytes = len(keys) * original_width * np.dtype(np.float32).itemsize
+    compact_bytes = reduced.nbytes
+    report = {
+        'feature': feature,
+        'method': method,
+        'rows': len(keys),
+        'original_dim': original_width,
+        'compressed_dim': dim,
+        'retained_variance': retained_energy / total_energy if total_energy else 1.0,
+        'original_float32_bytes': original_bytes,
+        'compact_float16_bytes': compact_bytes,
+        'memory_saved_ratio': 1 - compact_bytes / original_bytes if original_bytes else 0.0,
+    }
+    logger.info(
+        f"Compressed {feature}: {len(keys)} x {original_width} -> {dim} ({method}), "
+        f"retained variance {report['retained_variance']:.3f}, "
+        f"{original_bytes / 2**20:.1f} MiB -> {compact_bytes / 2**20:.1f} MiB"
+    )
+    return report
+
+def load_compact_features(feature, method=COMPRESSION_METHOD, dim=COMPRESSED_DIM):
+    """Load the reduced matrix and its row ids as written by compress_feature."""
+    with np.load(features_path(feature, method, dim)) as data:
+        return data['ids'], data['matrix']
+
+def compress_all(method=COMPRESSION_METHOD, dim=COMPRESSED_DIM, fit_sample=None, features=None):
+    """Compress every feature source and write a combined report."""
+    os.makedirs(FEATURES_DIR, exist_ok=True)
+    reports = []
+    for feature in features or FEATURE_SOURCES:
+        try:
+            reports.append(compress_feature(feature, method, dim, fit_sample))
+        except ValueError as e:
+            logger.warning(f"Skipping {feature}: {e}")
+    with open(os.path.join(FEATURES_DIR, 'compression_report.json'), 'w') as f:
+        json.dump(reports, f, indent=2)
+    return reports
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write PCA/random-projection float16 embedding features.")
+    parser.add_argument('--method', choices=['pca', 'random'], default=COMPRESSION_METHOD)
+    parser.add_argument('--dim', type=int, default=COMPRESSED_DIM)
+    parser.add_argument('--fit-sample', type=int, help="Fit PCA on about this many sampled rows")
+    parser.add_argument('--features', nargs='+', choices=sorted(FEATURE_SOURCES))
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    metrics.start_exporter()
+    for report in compress_all(args.method, args.dim, args.fit_sample, args.features):
+        print(f"{report['feature']}: retained variance {report['retained_variance']:.3f}, "
+              f"memory saved {report['memory_saved_ratio']:.1%}")
@@ -1,4 +1,3 @@
-import sqlite3
 import json
 import logging
 import os
@@ -8,7 +7,10 @@ import sys
 current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
 project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
 sys.path.insert(0, project_root)  # Add project root to the start of the search path
-from logging_config import setup_logging
+from logging_config import setup_logging, log_every_n
+from config import LOG_SAMPLE_EVERY
+import metrics
+import working_db
 
 # Setup logging
 setup_logging()
@@ -16,7 +18,8 @@ logger = logging.getLogger(__name__)
 
 def get_connection():
     from config import DATABASE_PATH
-    return sqlite3.connect(DATABASE_PATH)
+    # Resolves to the shared in-memory copy while working_db's in-memory mode is active
+    return working_db.connect(DATABASE_PATH)
 
 def insert_title_embedding(doi, embedding):
     """Insert title embedding into the database for a specific paper."""
@@ -28,9 +31,12 @@ def insert_title_embedding(doi, embedding):
             SET title_embedding = ?
             WHERE doi = ?
         """, (json.dumps(embedding), doi))
-        conn.commit()
+        metrics.increment('db_rows_written_total', cursor.rowcount, table='Papers')
+        with metrics.timer('db_commit'):
+            conn.commit()
         conn.close()
-        logger.info(f"Title embedding updated for DOI: {doi}")
+        log_every_n(logger, logging.INFO, 'insert_title_embedding', LOG_SAMPLE_EVERY,
+                    "Title embedding updated for DOI: %s", doi)
     except Exception as e:
         logger.error(f"Failed to update title embedding for DOI {doi}: {e}")
 
@@ -44,9 +50,12 @@ def insert_keyword_embedding(keyword_id, embedding):
             SET embedding = ?
             WHERE id = ?
         """, (json.dumps(embedding), keyword_id))
-        conn.commit()
+        metrics.increment('db_rows_written_total', cursor.rowcount, table='Keywords')
+        with metrics.timer('db_commit'):
+            conn.commit()
         conn.close()
-        logger.info(f"Keyword embedding updated for ID: {keyword_id}")
+        log_every_n(logger, logging.INFO, 'insert_keyword_embedding', LOG_SAMPLE_EVERY,
+                    "Keyword embedding updated for ID: %s", keyword_id)
     except Exception as e:
         logger.error(f"Failed to update keyword embedding for ID {keyword_id}: {e}")
 
@@ -99,20 +108,102 @@ def update_paper_age():
     except Exception as e:
         logger.error(f"Failed to update paper ages: {e}")
 
+# Normalised values go to <field>_norm so the raw counts stay refreshable (api/refresh.py)
+NORMALIZED_SUFFIX = '_norm'
+
 def normalize_field(table, field):
-    """Normalize a numerical field in a specified table."""
+    """Min-max normalize a numerical field into its <field>_norm column."""
+    target = f"{field}{NORMALIZED_SUFFIX}"
     try:
         conn = get_connection()
         cursor = conn.cursor()
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if target not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {target} REAL")
         cursor.execute(f"SELECT MIN({field}), MAX({field}) FROM {table}")
         min_val, max_val = cursor.fetchone()
         if min_val is not None and max_val is not None and min_val != max_val:
             cursor.execute(f"""
                 UPDATE {table}
-                SET {field} = ({field} - ?) / (?)
+                SET {target} = ({field} - ?) * 1.0 / (?)
             """, (min_val, max_val - min_val))
-            conn.commit()
+        else:
+            cursor.execute(f"UPDATE {table} SET {target} = CASE WHEN {field} IS NOT NULL THEN 0.0 END")
+        conn.commit()
         conn.close()
         logger.info(f"Field {field} in table {table} normalized successfully.")
     except Exception as e:
         logger.error(f"Failed to normalize field {field} in table {table}: {e}")
+
+def parse_vector(value):
+    """Decode a stored embedding; SPECTER vectors are wrapped as {"model": ..., "vector": [...]}.
+
+    Returns None for missing (NULL or NaN) and empty embeddings.
+    """
+    if not isinstance(value, (str, bytes)):
+        return None
+    vector = json.loads(value)
+    if isinstance(vector, dict):
+        vector = vector.get('vector')
+    return vector or None
+
+def iter_embeddings(table, key_column, column, chunk_size=10000, connection=None):
+    """Yield chunks of (key, embedding JSON) rows that have a non-null embedding.
+
+    Reads through ``connection`` when given (left open), else through a new connection.
+    """
+    conn = connection or get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {key_column}, {column}
+            FROM {table}
+            WHERE {column} IS NOT NULL
+            ORDER BY rowid
+        """)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    except Exception as e:
+        logger.error(f"Failed to read {column} from {table}: {e}")
+    finally:
+        if connection is None:
+            conn.close()
+
+def count_embeddings(table, column):
+    """Count rows with a non-null embedding."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} IS NOT NULL")
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Failed to count {column} in {table}: {e}")
+        return 0
+
+def iter_keyword_embeddings_without_topic(chunk_size=10000, connection=None):
+    """Yield chunks of (id, embedding JSON) for embedded keywords missing from KeywordTopics."""
+    conn = connection or get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT k.id, k.embedding
+            FROM Keywords k
+            LEFT JOIN KeywordTopics kt ON kt.keyword_id = k.id
+            WHERE k.embedding IS NOT NULL AND kt.keyword_id IS NULL
+            ORDER BY k.id
+        """)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    except Exception as e:
+        logger.error(f"Failed to read keywords without topic: {e}")
+    finally:
+        if connection is None:
+            conn.close()
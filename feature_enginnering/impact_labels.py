@@ -0,0 +1,239 @@
+import argparse
+import json
+import logging
+import numpy as np
+from scipy import sparse
+import feature_db_utils
+import metrics
+from config import LABEL_HORIZON, LABEL_TOP_PERCENT
+from working_db import working_database
+
+logger = logging.getLogger(__name__)
+
+def label_version(horizon=LABEL_HORIZON, top_percent=LABEL_TOP_PERCENT):
+    """Name under which labels built with these parameters are stored."""
+    return f"h{horizon}_top{top_percent:g}"
+
+def create_label_tables(connection):
+    """Create the versioned label tables; rows of different versions live side by side."""
+    c = connection.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS LabelVersions (
+            version TEXT PRIMARY KEY,
+            horizon INTEGER,
+            top_percent REAL,
+            cutoff_years TEXT,
+            created_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS PaperLabels (
+            version TEXT,
+            cutoff_year INTEGER,
+            doi TEXT,
+            citations_to_date INTEGER,
+            future_citations INTEGER,
+            top_in_year INTEGER,
+            top_in_journal_year INTEGER,
+            PRIMARY KEY (version, cutoff_year, doi),
+            FOREIGN KEY (doi) REFERENCES Papers(doi)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS KeywordLabels (
+            version TEXT,
+            cutoff_year INTEGER,
+            keyword_id INTEGER,
+            papers_to_date INTEGER,
+            recent_papers INTEGER,
+            future_papers INTEGER,
+            growth REAL,
+            future_citations INTEGER,
+            top_growth INTEGER,
+            PRIMARY KEY (version, cutoff_year, keyword_id),
+            FOREIGN KEY (keyword_id) REFERENCES Keywords(id)
+        )
+    ''')
+    connection.commit()
+
+def lookup(keys, values):
+    """Vectorized position of each value in ``keys``; -1 where a value is not present."""
+    if not len(keys):
+        return np.full(len(values), -1)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    positions = np.clip(np.searchsorted(sorted_keys, values), 0, len(keys) - 1)
+    return np.where(sorted_keys[positions] == values, order[positions], -1)
+
+def load_corpus(connection):
+    """Load papers with a year plus the citation and keyword edges between them as index arrays."""
+    rows = connection.execute("SELECT doi, year, journal_id FROM Papers WHERE year IS NOT NULL").fetchall()
+    dois = np.array([row[0] for row in rows], dtype=object)
+    years = np.array([int(row[1]) for row in rows], dtype=np.int64)
+    journals = np.array([-1 if row[2] is None else int(row[2]) for row in rows], dtype=np.int64)
+
+    citations = np.array(connection.execute("SELECT citing_doi, cited_doi FROM Citations").fetchall(),
+                         dtype=object).reshape(-1, 2)
+    citing, cited = lookup(dois, citations[:, 0]), lookup(dois, citations[:, 1])
+    valid = (citing >= 0) & (cited >= 0) & (citing != cited)
+    # Citations has no uniqueness constraint, so count each citing/cited pair once
+    edges = np.unique(np.stack([citing[valid], cited[valid]], axis=1), axis=0).reshape(-1, 2)
+
+    paper_keywords = np.array(connection.execute("SELECT paper_id, keyword_id FROM PaperKeywords").fetchall(),
+                              dtype=object).reshape(-1, 2)
+    papers = lookup(dois, paper_keywords[:, 0])
+    valid = papers >= 0
+    keyword_links = np.unique(
+        np.stack([papers[valid], paper_keywords[valid, 1].astype(np.int64)], axis=1), axis=0).reshape(-1, 2)
+    return dois, years, journals, edges, keyword_links
+
+def top_flags(values, groups, top_percent):
+    """Flag values in the top ``top_percent`` of their group, ties at the threshold included.
+
+    Zero values are never flagged, so groups with hardly any citations do not produce
+    spurious positives.
+    """
+    if not len(values):
+        return np.zeros(0, dtype=bool)
+    order = np.lexsort((values, groups))
+    sorted_values, sorted_groups = values[order], groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(values)])
+    cut = starts + np.minimum(np.floor(sizes * (1 - top_percent / 100)).astype(np.int64), sizes - 1)
+    thresholds = np.repeat(sorted_values[cut], sizes)
+    flags = np.zeros(len(values), dtype=bool)
+    flags[order] = (sorted_values >= thresholds) & (sorted_values > 0)
+    return flags
+
+def window_sum(matrix, start, stop):
+    """Row sums of the year columns [start, stop) of a CSC year matrix, clipped to its width."""
+    start, stop = max(start, 0), min(stop, matrix.shape[1])
+    if start >= stop:
+        return np.zeros(matrix.shape[0], dtype=np.int64)
+    return np.asarray(matrix[:, start:stop].sum(axis=1)).ravel().astype(np.int64)
+
+def compute_labels(dois, years, journals, edges, keyword_links, cutoffs, horizon, top_percent):
+    """Compute paper and keyword labels for every cutoff year over the whole graph at once.
+
+    Citations are only counted from papers in the corpus (the Citations table holds
+    in-corpus edges only), bucketed by the citing paper's publication year.  A paper is
+    labelled at a cutoff if it was published by then; its target is the number of
+    citations it receives in the ``horizon`` years after the cutoff.
+    """
+    first_year = int(years.min())
+    n_papers, n_years = len(years), int(years.max()) - first_year + 1
+    year_index = years - first_year
+
+    # papers x citing year: citations received per year
+    received = sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.int64), (edges[:, 1], year_index[edges[:, 0]])),
+        shape=(n_papers, n_years)).tocsc()
+    # keywords x papers incidence and keywords x publication year paper counts
+    keyword_ids, keyword_index = np.unique(keyword_links[:, 1], return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(keyword_links), dtype=np.int64), (keyword_index, keyword_links[:, 0])),
+        shape=(len(keyword_ids), n_papers))
+    published = sparse.csr_matrix(
+        (np.ones(n_papers, dtype=np.int64), (np.arange(n_papers), year_index)), shape=(n_papers, n_years))
+    keyword_years = (incidence @ published).tocsc()
+    journal_year = journals * n_years + year_index
+
+    paper_rows, keyword_rows = [], []
+    for cutoff in cutoffs:
+        t = cutoff - first_year
+        eligible = np.flatnonzero(years <= cutoff)
+        to_date = window_sum(received, 0, t + 1)
+        future = window_sum(received, t + 1, t + 1 + horizon)
+        top_year = top_flags(future[eligible], year_index[eligible], top_percent)
+        top_journal = top_flags(future[eligible], journal_year[eligible], top_percent)
+        # Papers without a journal have no journal-year group to be ranked in
+        top_journal &= journals[eligible] >= 0
+        paper_rows.append((cutoff, eligible, to_date[eligible], future[eligible], top_year, top_journal))
+
+        papers_to_date = window_sum(keyword_years, 0, t + 1)
+        recent = window_sum(keyword_years, t + 1 - horizon, t + 1)
+        future_papers = window_sum(keyword_years, t + 1, t + 1 + horizon)
+        growth = (future_papers - recent) / (recent + 1)
+        # Future citations to the keyword's papers that existed at the cutoff
+        future_citations = incidence @ np.where(years <= cutoff, future, 0)
+        active = np.flatnonzero(papers_to_date > 0)
+        top_growth = top_flags(growth[active], np.zeros(len(active), dtype=np.int64), top_percent)
+        keyword_rows.append((cutoff, keyword_ids[active], papers_to_date[active], recent[active],
+                             future_papers[active], growth[active], future_citations[active], top_growth))
+    return paper_rows, keyword_rows
+
+def write_labels(connection, version, horizon, top_percent, cutoffs, dois, paper_rows, keyword_rows):
+    """Replace all rows of ``version`` in one transaction."""
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM PaperLabels WHERE version = ?", (version,))
+    cursor.execute("DELETE FROM KeywordLabels WHERE version = ?", (version,))
+    paper_count = keyword_count = 0
+    for cutoff, eligible, to_date, future, top_year, top_journal in paper_rows:
+        cursor.executemany(
+            "INSERT INTO PaperLabels VALUES (?, ?, ?, ?, ?, ?, ?)",
+            zip([version] * len(eligible), [cutoff] * len(eligible), dois[eligible].tolist(), to_date.tolist(),
+                future.tolist(), top_year.astype(int).tolist(), top_journal.astype(int).tolist()))
+        paper_count += len(eligible)
+    for cutoff, keyword_ids, papers_to_date, recent, future_papers, growth, future_citations, top_growth in keyword_rows:
+        cursor.executemany(
+            "INSERT INTO KeywordLabels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            zip([version] * len(keyword_ids), [cutoff] * len(keyword_ids), keyword_ids.tolist(),
+                papers_to_date.tolist(), recent.tolist(), future_papers.tolist(), growth.tolist(),
+                future_citations.tolist(), top_growth.astype(int).tolist()))
+        keyword_count += len(keyword_ids)
+    cursor.execute("""
+        INSERT OR REPLACE INTO LabelVersions (version, horizon, top_percent, cutoff_years, created_at)
+        VALUES (?, ?, ?, ?, datetime('now'))
+    """, (version, horizon, top_percent, json.dumps(list(cutoffs))))
+    metrics.increment('db_rows_written_total', paper_count, table='PaperLabels')
+    metrics.increment('db_rows_written_total', keyword_count, table='KeywordLabels')
+    with metrics.timer('db_commit'):
+        connection.commit()
+    return paper_count, keyword_count
+
+def build_labels(connection, horizon=LABEL_HORIZON, top_percent=LABEL_TOP_PERCENT, cutoffs=None, version=None):
+    """Compute future-impact labels and store them under a version name.
+
+    By default every cutoff year whose full horizon lies inside the corpus is labelled,
+    so no target is truncated by the end of the data.
+    """
+    version = version or label_version(horizon, top_percent)
+    create_label_tables(connection)
+    with metrics.timer('labels_phase', phase='load'):
+        dois, years, journals, edges, keyword_links = load_corpus(connection)
+    if not len(years):
+        logger.warning("No papers with a publication year; no labels built.")
+        return version, 0, 0
+    if cutoffs is None:
+        cutoffs = list(range(int(years.min()), int(years.max()) - horizon + 1))
+    if not cutoffs:
+        logger.warning(f"Corpus spans {years.min()}-{years.max()}, too short for a {horizon}-year horizon.")
+        return version, 0, 0
+
+    with metrics.timer('labels_phase', phase='compute'):
+        paper_rows, keyword_rows = compute_labels(
+            dois, years, journals, edges, keyword_links, cutoffs, horizon, top_percent)
+    with metrics.timer('labels_phase', phase='write'):
+        paper_count, keyword_count = write_labels(
+            connection, version, horizon, top_percent, cutoffs, dois, paper_rows, keyword_rows)
+    logger.info(f"Labels {version}: {paper_count} paper rows and {keyword_count} keyword rows "
+                f"for cutoffs {cutoffs[0]}-{cutoffs[-1]} from {len(edges)} citations.")
+    return version, paper_count, keyword_count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build versioned future-impact labels for papers and keywords.")
+    parser.add_argument('--horizon', type=int, default=LABEL_HORIZON, help="Years after the cutoff to count")
+    parser.add_argument('--top-percent', type=float, default=LABEL_TOP_PERCENT)
+    parser.add_argument('--cutoffs', type=int, nargs='+', help="Cutoff years (default: all with a full horizon)")
+    parser.add_argument('--version', help="Label version name (default: derived from the parameters)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    metrics.start_exporter()
+    with working_database():
+        connection = feature_db_utils.get_connection()
+        try:
+            build_labels(connection, args.horizon, args.top_percent, args.cutoffs, args.version)
+        finally:
+            connection.close()
@@ -0,0 +1,253 @@
+import argparse
+import json
+import logging
+import numpy as np
+import feature_db_utils
+import metrics
+from compress_features import iter_chunks
+from config import TOPIC_COUNT, TOPIC_BATCH_SIZE, TOPIC_EPOCHS
+from working_db import working_database
+
+logger = logging.getLogger(__name__)
+
+def create_topic_tables(connection):
+    """Create the topic tables and the paper -> topic view used for downstream aggregation."""
+    c = connection.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS Topics (
+            topic_id INTEGER PRIMARY KEY,
+            label TEXT,
+            size INTEGER,
+            weight INTEGER,
+            centroid TEXT,
+            updated_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS KeywordTopics (
+            keyword_id INTEGER PRIMARY KEY,
+            topic_id INTEGER,
+            similarity REAL,
+            FOREIGN KEY (keyword_id) REFERENCES Keywords(id),
+            FOREIGN KEY (topic_id) REFERENCES Topics(topic_id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_keywordtopics_topic ON KeywordTopics (topic_id)')
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS PaperTopics AS
+        SELECT DISTINCT pk.paper_id, kt.topic_id
+        FROM PaperKeywords pk
+        JOIN KeywordTopics kt ON kt.keyword_id = pk.keyword_id
+    ''')
+    connection.commit()
+
+def normalize(matrix):
+    """Scale rows to unit length so dot products are cosine similarities."""
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+def nearest(batch, centroids):
+    """Index of and cosine similarity to the closest centroid for each row."""
+    similarities = batch @ centroids.T
+    labels = similarities.argmax(axis=1)
+    return labels, similarities[np.arange(len(batch)), labels]
+
+def minibatch_update(centroids, weights, batch, labels):
+    """Mini-batch k-means step: move each centroid to the running mean of the rows it has seen.
+
+    ``weights`` counts the rows every centroid has absorbed so far, which gives each
+    centroid its own decaying learning rate; the model can therefore keep absorbing new
+    keywords later without being refitted.
+    """
+    counts = np.bincount(labels, minlength=len(centroids))
+    touched = np.flatnonzero(counts)
+    order = np.argsort(labels, kind='stable')
+    sums = np.add.reduceat(batch[order], np.r_[0, np.cumsum(counts[touched])[:-1]], axis=0)
+    weights[touched] += counts[touched]
+    centroids[touched] += (sums - counts[touched, None] * centroids[touched]) / weights[touched, None]
+    centroids[touched] = normalize(centroids[touched])
+
+def sample_rows(connection, n_samples, rng):
+    """Reservoir-sample normalized keyword embeddings in one streamed pass."""
+    sample = None
+    seen = 0
+    for _, matrix in iter_chunks('keyword_embedding', connection=connection):
+        matrix = normalize(matrix)
+        if sample is None:
+            sample = np.empty((n_samples, matrix.shape[1]), dtype=np.float32)
+        fill = max(0, min(n_samples - seen, len(matrix)))
+        sample[seen:seen + fill] = matrix[:fill]
+        # Algorithm R: row number i replaces a random slot with probability n_samples / (i + 1)
+        slots = rng.integers(0, np.arange(seen + fill, seen + len(matrix)) + 1)
+        replace = slots < n_samples
+        sample[slots[replace]] = matrix[fill:][replace]
+        seen += len(matrix)
+    if sample is None:
+        return None
+    return sample[:min(seen, n_samples)]
+
+def fit_topics(connection, n_topics=TOPIC_COUNT, batch_size=TOPIC_BATCH_SIZE, epochs=TOPIC_EPOCHS, seed=42):
+    """Fit spherical mini-batch k-means over the streamed keyword embeddings.
+
+    Only one chunk, one batch and the k x d centroid matrix are in memory at a time.
+    Centroids start from a random sample of keywords; topics left empty after an epoch
+    are re-seeded from the sampled keywords farthest from any centroid.
+    """
+    rng = np.random.default_rng(seed)
+    sample = sample_rows(connection, max(3 * n_topics, batch_size), rng)
+    if sample is None:
+        raise ValueError("No keyword embeddings to cluster")
+    n_topics = min(n_topics, len(sample))
+    centroids = sample[rng.choice(len(sample), n_topics, replace=False)].copy()
+    weights = np.zeros(n_topics, dtype=np.int64)
+
+    for epoch in range(epochs):
+        hits = np.zeros(n_topics, dtype=np.int64)
+        distance = 0.0
+        rows = 0
+        with metrics.timer('topic_fit_epoch'):
+            for _, matrix in iter_chunks('keyword_embedding', connection=connection):
+                matrix = normalize(matrix)[rng.permutation(len(matrix))]
+                for start in range(0, len(matrix), batch_size):
+                    batch = matrix[start:start + batch_size]
+                    labels, similarity = nearest(batch, centroids)
+                    minibatch_update(centroids, weights, batch, labels)
+                    hits += np.bincount(labels, minlength=n_topics)
+                    distance += float((1 - similarity).sum())
+                    rows += len(batch)
+        empty = np.flatnonzero(hits == 0)
+        logger.info(f"Topic fit epoch {epoch + 1}/{epochs}: mean cosine distance {distance / rows:.4f}, "
+                    f"{len(empty)} empty topics.")
+        metrics.set_gauge('topic_fit_mean_distance', distance / rows)
+        if len(empty) and epoch < epochs - 1:
+            _, similarity = nearest(sample, centroids)
+            farthest = np.argsort(similarity)[:len(empty)]
+            centroids[empty] = sample[farthest]
+            weights[empty] = 0
+    return centroids, weights
+
+def assign_all(connection, centroids, batch_size=TOPIC_BATCH_SIZE):
+    """Assign every embedded keyword to its nearest topic."""
+    keyword_ids, labels, similarities = [], [], []
+    for keys, matrix in iter_chunks('keyword_embedding', connection=connection):
+        matrix = normalize(matrix)
+        for start in range(0, len(matrix), batch_size):
+            batch_labels, batch_similarity = nearest(matrix[start:start + batch_size], centroids)
+            labels.append(batch_labels)
+            similarities.append(batch_similarity)
+        keyword_ids.extend(keys)
+    return np.asarray(keyword_ids, dtype=np.int64), np.concatenate(labels), np.concatenate(similarities)
+
+def representative_keywords(keyword_ids, labels, similarities):
+    """For each topic, the member keyword closest to the centroid."""
+    order = np.lexsort((-similarities, labels))
+    first = np.r_[True, labels[order][1:] != labels[order][:-1]]
+    return dict(zip(labels[order][first].tolist(), keyword_ids[order][first].tolist()))
+
+def write_topics(connection, centroids, weights, keyword_ids, labels, similarities, topic_labels=None, replace=False):
+    """Store centroids (topic_id = row + 1) and keyword assignments, then refresh topic sizes."""
+    cursor = connection.cursor()
+    if replace:
+        cursor.execute("DELETE FROM KeywordTopics")
+        cursor.execute("DELETE FROM Topics")
+    cursor.executemany("""
+        INSERT INTO Topics (topic_id, label, weight, centroid, updated_at) VALUES (?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(topic_id) DO UPDATE SET
+            weight = excluded.weight, centroid = excluded.centroid, updated_at = excluded.updated_at,
+            label = COALESCE(excluded.label, Topics.label)
+    """, (
+        (topic + 1, (topic_labels or {}).get(topic), int(weights[topic]), json.dumps(centroids[topic].tolist()))
+        for topic in range(len(centroids))
+    ))
+    cursor.executemany(
+        "INSERT OR REPLACE INTO KeywordTopics (keyword_id, topic_id, similarity) VALUES (?, ?, ?)",
+        zip(keyword_ids.tolist(), (labels + 1).tolist(), similarities.astype(float).tolist()))
+    cursor.execute("UPDATE Topics SET size = (SELECT COUNT(*) FROM KeywordTopics kt WHERE kt.topic_id = Topics.topic_id)")
+    metrics.increment('db_rows_written_total', len(keyword_ids), table='KeywordTopics')
+    with metrics.timer('db_commit'):
+        connection.commit()
+
+def load_topics(connection):
+    """Load the stored centroids and weights, or None if no topic model has been fitted."""
+    rows = connection.execute("SELECT weight, centroid FROM Topics ORDER BY topic_id").fetchall()
+    if not rows:
+        return None
+    centroids = np.asarray([json.loads(centroid) for _, centroid in rows], dtype=np.float32)
+    weights = np.asarray([weight or 0 for weight, _ in rows], dtype=np.int64)
+    return centroids, weights
+
+def refit_topics(connection, n_topics=TOPIC_COUNT, batch_size=TOPIC_BATCH_SIZE, epochs=TOPIC_EPOCHS):
+    """Fit a new topic model from scratch and reassign every keyword."""
+    create_topic_tables(connection)
+    centroids, weights = fit_topics(connection, n_topics, batch_size, epochs)
+    with metrics.timer('topic_assign'):
+        keyword_ids, labels, similarities = assign_all(connection, centroids, batch_size)
+    representatives = representative_keywords(keyword_ids, labels, similarities)
+    names = dict(connection.execute(
+        f"SELECT id, keyword FROM Keywords WHERE id IN ({', '.join('?' for _ in representatives)})",
+        list(representatives.values())).fetchall())
+    topic_labels = {topic: names.get(keyword_id) for topic, keyword_id in representatives.items()}
+    write_topics(connection, centroids, weights, keyword_ids, labels, similarities, topic_labels, replace=True)
+    logger.info(f"Clustered {len(keyword_ids)} keywords into {len(centroids)} topics.")
+    return len(keyword_ids)
+
+def assign_new_keywords(connection, batch_size=TOPIC_BATCH_SIZE, update_centroids=True, n_topics=TOPIC_COUNT):
+    """Assign keywords without a topic to the existing model, folding them into the centroids.
+
+    Keywords assigned earlier keep their topic even though centroids drift a little;
+    use refit_topics to reassign everything.  ``n_topics`` only applies when no model
+    exists yet and one is fitted.
+    """
+    create_topic_tables(connection)
+    model = load_topics(connection)
+    if model is None:
+        return refit_topics(connection, n_topics, batch_size)
+    centroids, weights = model
+    keyword_ids, labels, similarities = [], [], []
+    for rows in feature_db_utils.iter_keyword_embeddings_without_topic(connection=connection):
+        keys, vectors = [], []
+        for keyword_id, value in rows:
+            vector = feature_db_utils.parse_vector(value)
+            if vector:
+                keys.append(keyword_id)
+                vectors.append(vector)
+        if not vectors:
+            continue
+        matrix = normalize(np.asarray(vectors, dtype=np.float32))
+        for start in range(0, len(matrix), batch_size):
+            batch = matrix[start:start + batch_size]
+            batch_labels, batch_similarity = nearest(batch, centroids)
+            if update_centroids:
+                minibatch_update(centroids, weights, batch, batch_labels)
+            labels.append(batch_labels)
+            similarities.append(batch_similarity)
+        keyword_ids.extend(keys)
+    if not keyword_ids:
+        logger.info("No new keywords to assign to topics.")
+        return 0
+    write_topics(connection, centroids, weights, np.asarray(keyword_ids, dtype=np.int64),
+                 np.concatenate(labels), np.concatenate(similarities))
+    metrics.increment('topic_incremental_assignments_total', len(keyword_ids))
+    logger.info(f"Assigned {len(keyword_ids)} new keywords to existing topics.")
+    return len(keyword_ids)
+
+def cluster_keywords(connection, refit=False, n_topics=TOPIC_COUNT):
+    """Incrementally assign new keywords, or fit from scratch if asked or no model exists."""
+    if refit:
+        return refit_topics(connection, n_topics)
+    return assign_new_keywords(connection, n_topics=n_topics)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cluster keyword embeddings into topics with mini-batch k-means.")
+    parser.add_argument('--refit', action='store_true', help="Fit a new model and reassign every keyword")
+    parser.add_argument('--topics', type=int, default=TOPIC_COUNT)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    metrics.start_exporter()
+    with working_database():
+        connection = feature_db_utils.get_connection()
+        try:
+            cluster_keywords(connection, args.refit, args.topics)
+        finally:
+            connection.close()
@@ -1,7 +1,9 @@
 import feature_db_utils
+import metrics
+from working_db import working_database
 
 def normalize_data():
-    """Normalize numerical fields in the database."""
+    """Normalize numerical fields into <field>_norm columns, keeping the raw counts."""
     fields_to_normalize = [
         ('Authors', 'paperCount'),
         ('Authors', 'citationCount'),
@@ -12,12 +14,16 @@ def normalize_data():
     ]
 
     for table, field in fields_to_normalize:
-        feature_db_utils.normalize_field(table, field)
+        with metrics.timer('normalize_field', table=table, field=field):
+            feature_db_utils.normalize_field(table, field)
 
 def update_paper_ages():
     """Update the age of papers."""
-    feature_db_utils.update_paper_age()
+    with metrics.timer('update_paper_age'):
+        feature_db_utils.update_paper_age()
 
 if __name__ == '__main__':
-    update_paper_ages()
-    normalize_data()
\ No newline at end of file
+    metrics.start_exporter()
+    with working_database():
+        update_paper_ages()
+        normalize_data()
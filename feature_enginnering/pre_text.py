@@ -1,6 +1,9 @@
 from transformers import BertTokenizer, BertModel
 import torch
+import time
 import feature_db_utils
+import metrics
+from working_db import working_database
 
 # Initialize BERT model and tokenizer
 tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
@@ -9,24 +12,38 @@ model = BertModel.from_pretrained('bert-base-uncased')
 def generate_embedding(text):
     """Generate embedding for a given text using BERT."""
     inputs = tokenizer(text, return_tensors='pt', max_length=512, truncation=True, padding='max_length')
-    with torch.no_grad():
+    with metrics.timer('embedding_forward'), torch.no_grad():
         outputs = model(**inputs)
     return outputs.last_hidden_state.mean(dim=1).squeeze().tolist()
 
+def record_throughput(kind, count, start):
+    """Publish embeddings/sec for a finished embedding pass."""
+    elapsed = time.perf_counter() - start
+    if count and elapsed > 0:
+        metrics.set_gauge('embeddings_per_second', count / elapsed, kind=kind)
+
 def embed_titles():
     """Generate embeddings for paper titles and update the database."""
     papers = feature_db_utils.get_papers_without_title_embedding()
+    start = time.perf_counter()
     for doi, title in papers:
         embedding = generate_embedding(title)
         feature_db_utils.insert_title_embedding(doi, embedding)
+        metrics.increment('embeddings_total', kind='title')
+    record_throughput('title', len(papers), start)
 
 def embed_keywords():
     """Generate embeddings for keywords and update the database."""
     keywords = feature_db_utils.get_keywords_without_embedding()
+    start = time.perf_counter()
     for keyword_id, keyword in keywords:
         embedding = generate_embedding(keyword)
         feature_db_utils.insert_keyword_embedding(keyword_id, embedding)
+        metrics.increment('embeddings_total', kind='keyword')
+    record_throughput('keyword', len(keywords), start)
 
 if __name__ == '__main__':
-    embed_titles()
-    embed_keywords()
+    metrics.start_exporter()
+    with working_database():
+        embed_titles()
+        embed_keywords()
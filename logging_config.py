@@ -1,14 +1,101 @@
+import atexit
 import logging
+import logging.handlers
 import os
-from config import LOG_FILE
+import queue
+import threading
+import time
+from config import LOG_FILE, LOG_LEVEL, LOG_LEVELS
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'  # Include logger name in the format
+
+# Background listener that owns the file handler; None until setup_logging runs
+_listener = None
+_queue_handler = None
+_sample_lock = threading.Lock()
+_sample_counts = {}
+_last_emitted = {}
+
+def configured_levels():
+    """Merge per-module levels from config with the LOG_LEVELS environment variable."""
+    levels = dict(LOG_LEVELS)
+    for item in os.environ.get('LOG_LEVELS', '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
 
 def setup_logging():
+    """Route all records through a queue so file I/O happens on a background thread.
+
+    Safe to call from every module; only the first call configures logging.  Like
+    ``logging.basicConfig`` it leaves an already configured root logger alone.
+    """
+    global _listener, _queue_handler
+    root = logging.getLogger()
+    if _listener is not None or root.handlers:
+        return
+
     log_dir = os.path.dirname(LOG_FILE)  # Extract directory path from LOG_FILE
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)  # Create log directory if it does not exist
-
-    logging.basicConfig(
-        filename=LOG_FILE,
-        level=logging.DEBUG,  # Change to DEBUG to capture all log messages
-        format='%(asctime)s - %(levelname)s - %(name)s - %(message)s'  # Include logger name in the format
-    )
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)  # Create log directory if it does not exist
+
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', LOG_LEVEL).upper())
+    for name, level in configured_levels().items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flush queued records to disk and stop the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def _restart_after_fork():
+    """Forked children inherit the queue handler but not the listener thread, so start a new one."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = _queue_handler = None
+    setup_logging()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+def log_every_n(logger, level, key, n, msg, *args):
+    """Log only every ``n``-th occurrence of a per-row event identified by ``key``.
+
+    The message is formatted lazily, so skipped and disabled events cost a counter
+    increment at most.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    with _sample_lock:
+        count = _sample_counts.get(key, 0) + 1
+        _sample_counts[key] = count
+    if count == 1 or count % n == 0:
+        logger.log(level, f"{msg} [occurrence {count}]", *args)
+
+def log_throttled(logger, level, key, interval, msg, *args):
+    """Log an event identified by ``key`` at most once every ``interval`` seconds."""
+    if not logger.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    with _sample_lock:
+        if now - _last_emitted.get(key, float('-inf')) < interval:
+            return
+        _last_emitted[key] = now
+    logger.log(level, msg, *args)
@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_FILE, METRICS_FORMAT, METRICS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = 'biblio_'
+
+# Registries keyed by (metric name, sorted label pairs)
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_exporter = None
+_started_at = time.time()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to its latest value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                'count': 0, 'sum': 0.0, 'min': value, 'max': value, 'buckets': [0] * len(BUCKETS)
+            }
+        histogram['count'] += 1
+        histogram['sum'] += value
+        histogram['min'] = min(histogram['min'], value)
+        histogram['max'] = max(histogram['max'], value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+                break
+
+@contextmanager
+def timer(name, **labels):
+    """Time the enclosed block into the ``<name>_seconds`` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+def reset():
+    """Clear every metric, e.g. in a forked worker that should not re-report its parent's."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def snapshot():
+    """Return a JSON-serializable copy of every metric."""
+    def entries(registry):
+        return [{'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(registry.items())]
+
+    with _lock:
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': time.time() - _started_at,
+            'counters': entries(_counters),
+            'gauges': entries(_gauges),
+            'histograms': entries({key: dict(value, buckets=list(value['buckets']))
+                                   for key, value in _histograms.items()})
+        }
+
+def _format_labels(labels, **extra):
+    pairs = dict(labels, **extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs.items()) + '}'
+
+def to_prometheus(data):
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for kind, entries in (('counter', data['counters']), ('gauge', data['gauges'])):
+        typed = set()
+        for entry in entries:
+            name = PREFIX + entry['name']
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(entry['labels'])} {entry['value']}")
+
+    typed = set()
+    for entry in data['histograms']:
+        name = PREFIX + entry['name']
+        value = entry['value']
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, value['buckets']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(entry['labels'], le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(entry['labels'], le='+Inf')} {value['count']}")
+        lines.append(f"{name}_sum{_format_labels(entry['labels'])} {value['sum']}")
+        lines.append(f"{name}_count{_format_labels(entry['labels'])} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+def write_snapshot(path=METRICS_FILE, fmt=METRICS_FORMAT):
+    """Write the current metrics atomically so scrapers never see a partial file."""
+    data = snapshot()
+    content = to_prometheus(data) if fmt == 'prometheus' else json.dumps(data, indent=2)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def log_summary():
+    """Log an end-of-run summary of counters, gauges and timings."""
+    data = snapshot()
+    logger.info(f"Metrics summary after {data['uptime_seconds']:.1f}s")
+    for entry in data['counters'] + data['gauges']:
+        logger.info(f"  {entry['name']}{_format_labels(entry['labels'])} = {entry['value']}")
+    for entry in data['histograms']:
+        value = entry['value']
+        mean = value['sum'] / value['count'] if value['count'] else 0
+        logger.info(
+            f"  {entry['name']}{_format_labels(entry['labels'])}: count={value['count']} "
+            f"total={value['sum']:.3f} mean={mean:.4f} min={value['min']:.4f} max={value['max']:.4f}"
+        )
+
+def _export_loop(stop_event, interval):
+    while not stop_event.wait(interval):
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {e}")
+
+def _finish(stop_event):
+    stop_event.set()
+    try:
+        write_snapshot()
+    except OSError as e:
+        logger.error(f"Failed to write final metrics snapshot: {e}")
+    log_summary()
+
+def start_exporter(interval=METRICS_INTERVAL):
+    """Export snapshots every ``interval`` seconds and write a summary at exit.
+
+    Safe to call from every entry point; only the first call starts the exporter.
+    """
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        stop_event = threading.Event()
+        _exporter = threading.Thread(target=_export_loop, args=(stop_event, interval),
+                                     name='metrics-exporter', daemon=True)
+    _exporter.start()
+    atexit.register(_finish, stop_event)
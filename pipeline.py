@@ -0,0 +1,365 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+# Make every stage directory importable, as running the stage scripts directly would
+project_root = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, project_root)
+for stage_dir in ('build_db', 'api', 'feature_enginnering', 'build_network'):
+    sys.path.append(os.path.join(project_root, stage_dir))
+
+from config import DATABASE_PATH, FILE_PATH, FEATURES_DIR
+from logging_config import setup_logging
+import metrics
+import profiling
+import working_db
+
+# Setup logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'data/pipeline_state.json'
+WOS_FILES = [
+    'data/WOS_data/CSV/ce-500.csv',
+    'data/WOS_data/CSV/de-500.csv',
+    'data/WOS_data/CSV/se-500.csv',
+]
+GRAPH_TABLES = ['Papers', 'Authors', 'Keywords', 'Authorship', 'Citations', 'PaperKeywords', 'Journals']
+LABEL_TABLES = ['PaperLabels', 'KeywordLabels']
+
+# Stage callables import their modules lazily so heavy dependencies (BERT, torch)
+# are only loaded for the stages that actually run.
+def run_preprocess(options):
+    import pre_main
+    pre_main.merge_and_preprocess()
+
+def run_init_db(options):
+    from init_db import create_database
+    create_database().close()
+
+def run_papers(options):
+    import api_main
+    api_main.main(run_papers=True, run_citations=False, one_pass=options.one_pass)
+
+def run_citations(options):
+    import api_main
+    if options.one_pass:
+        # Edges were written during paper ingestion; OpenCitations only fills gaps
+        connection = working_db.connect(DATABASE_PATH)
+        try:
+            api_main.fill_citation_gaps(connection)
+        finally:
+            connection.close()
+    else:
+        api_main.main(run_papers=False, run_citations=True)
+
+def run_title_embeddings(options):
+    import pre_text
+    pre_text.embed_titles()
+
+def run_keyword_embeddings(options):
+    import pre_text
+    pre_text.embed_keywords()
+
+def run_numeric(options):
+    import pre_numeric
+    pre_numeric.update_paper_ages()
+    pre_numeric.normalize_data()
+
+def run_compress_features(options):
+    import compress_features
+    compress_features.compress_all()
+
+def run_keyword_topics(options):
+    import keyword_topics
+    connection = working_db.connect(DATABASE_PATH)
+    try:
+        keyword_topics.cluster_keywords(connection)
+    finally:
+        connection.close()
+
+def run_labels(options):
+    import impact_labels
+    connection = working_db.connect(DATABASE_PATH)
+    try:
+        impact_labels.build_labels(connection)
+    finally:
+        connection.close()
+
+def run_build_network(options):
+    import build_network
+    build_network.main()
+
+# Resources are 'file:<path>' or 'db:<Table>[.<column>]'. A stage depends on every
+# earlier stage whose outputs overlap its inputs, plus any stages listed in 'after'.
+# 'in_memory' stages run inside working_database(), so IN_MEMORY_DB applies to them;
+# init_db and build_network open the disk file directly and stay outside it.
+STAGES = [
+    {'name': 'preprocess', 'run': run_preprocess,
+     'inputs': [f"file:{path}" for path in WOS_FILES], 'outputs': [f"file:{FILE_PATH}"]},
+    # init_db drops every table, so it never runs over an existing schema unless named in --only
+    {'name': 'init_db', 'run': run_init_db, 'destructive': True,
+     'inputs': [], 'outputs': [f"file:{DATABASE_PATH}"]},
+    {'name': 'papers', 'run': run_papers, 'in_memory': True, 'after': ['init_db'],
+     'inputs': [f"file:{FILE_PATH}"],
+     'outputs': ['db:Papers', 'db:Authors', 'db:Authorship', 'db:Journals',
+                 'db:Keywords.keyword', 'db:PaperKeywords']},
+    {'name': 'citations', 'run': run_citations, 'in_memory': True,
+     'inputs': ['db:Papers.doi'], 'outputs': ['db:Citations']},
+    {'name': 'title_embeddings', 'run': run_title_embeddings, 'in_memory': True,
+     'inputs': ['db:Papers.title'], 'outputs': ['db:Papers.title_embedding']},
+    {'name': 'keyword_embeddings', 'run': run_keyword_embeddings, 'in_memory': True,
+     'inputs': ['db:Keywords.keyword'], 'outputs': ['db:Keywords.embedding']},
+    # Whole-table normalization UPDATEs would hold the write lock long enough to make the
+    # per-row embedding writers time out, so numeric waits for them.
+    {'name': 'numeric', 'run': run_numeric, 'in_memory': True, 'after': ['title_embeddings', 'keyword_embeddings'],
+     'inputs': ['db:Papers.citation_count', 'db:Papers.reference_count',
+                'db:Papers.influential_citation_count', 'db:Papers.year',
+                'db:Authors.paperCount', 'db:Authors.citationCount', 'db:Authors.hIndex'],
+     'outputs': ['db:Papers.citation_count_norm', 'db:Papers.reference_count_norm',
+                 'db:Papers.influential_citation_count_norm',
+                 'db:Authors.paperCount_norm', 'db:Authors.citationCount_norm', 'db:Authors.hIndex_norm']},
+    {'name': 'compress_features', 'run': run_compress_features, 'in_memory': True,
+     'inputs': ['db:Papers.embedding', 'db:Papers.title_embedding', 'db:Keywords.embedding'],
+     'outputs': [f"file:{FEATURES_DIR}/compression_report.json"]},
+    {'name': 'keyword_topics', 'run': run_keyword_topics, 'in_memory': True,
+     'inputs': ['db:Keywords.embedding'], 'outputs': ['db:Topics', 'db:KeywordTopics']},
+    {'name': 'labels', 'run': run_labels, 'in_memory': True,
+     'inputs': ['db:Papers.doi', 'db:Papers.year', 'db:Papers.journal_id', 'db:Citations', 'db:PaperKeywords'],
+     'outputs': ['db:PaperLabels', 'db:KeywordLabels', 'db:LabelVersions']},
+    {'name': 'build_network', 'run': run_build_network, 'after': ['compress_features'],
+     'inputs': [f"db:{table}" for table in GRAPH_TABLES + LABEL_TABLES], 'outputs': []},
+]
+
+def overlaps(a, b):
+    """True if two resources name the same file, table or column (a table covers its columns)."""
+    return a == b or a.startswith(b + '.') or b.startswith(a + '.')
+
+def stage_dependencies(stages):
+    """Map each stage name to the earlier stages it must wait for."""
+    dependencies = {}
+    for i, stage in enumerate(stages):
+        needs = set(stage.get('after', []))
+        for earlier in stages[:i]:
+            if any(overlaps(inp, out) for inp in stage['inputs'] for out in earlier['outputs']):
+                needs.add(earlier['name'])
+        dependencies[stage['name']] = needs
+    return dependencies
+
+def file_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def table_fingerprint(connection, table, columns=None):
+    """Cheap content fingerprint of a table: row count plus per-column aggregates."""
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not exists:
+        return None
+    existing = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+    if columns is None:
+        columns = existing
+    elif not set(columns) <= set(existing):
+        # Columns added by a stage (e.g. numeric's *_norm) do not exist before it first runs
+        return None
+    aggregates = ['COUNT(*)']
+    for column in columns:
+        aggregates += [
+            f"COUNT({column})",
+            f"TOTAL(LENGTH({column}))",
+            f"TOTAL(CASE WHEN typeof({column}) IN ('integer', 'real') THEN {column} END)",
+        ]
+    return list(connection.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone())
+
+def resource_fingerprint(resource):
+    kind, name = resource.split(':', 1)
+    if kind == 'file':
+        return file_fingerprint(name)
+    if not os.path.exists(DATABASE_PATH):
+        return None
+    table, _, column = name.partition('.')
+    with sqlite3.connect(DATABASE_PATH) as connection:
+        return table_fingerprint(connection, table, [column] if column else None)
+
+def database_has_schema():
+    """True if the database holds any of the tables init_db would drop."""
+    if not os.path.exists(DATABASE_PATH):
+        return False
+    with sqlite3.connect(DATABASE_PATH) as connection:
+        # Table names are case-insensitive in SQLite, so DROP TABLE Papers also drops papers
+        names = {row[0].lower() for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return any(table.lower() in names for table in GRAPH_TABLES)
+
+def resource_exists(resource):
+    return resource_fingerprint(resource) is not None
+
+def stage_fingerprint(stage):
+    """Fingerprint all of a stage's inputs into a single digest."""
+    values = {resource: resource_fingerprint(resource) for resource in stage['inputs']}
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_path = f"{STATE_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+def is_up_to_date(stage, state, dependencies=()):
+    """A stage is current if its inputs are unchanged and no dependency ran after it.
+
+    Input fingerprints alone miss upstream stages that rewrote the database wholesale
+    (init_db drops every table), so a newer dependency run forces a re-run too.
+    """
+    previous = state.get(stage['name'])
+    if not previous or previous.get('status') != 'done':
+        return False
+    for dependency in dependencies:
+        finished_at = state.get(dependency, {}).get('finished_at')
+        if finished_at and finished_at > previous.get('finished_at', ''):
+            return False
+    if not all(resource_exists(resource) for resource in stage['outputs']):
+        return False
+    return previous.get('fingerprint') == stage_fingerprint(stage)
+
+def execute_stage(stage, options):
+    """Run one stage and return its elapsed time."""
+    logger.info(f"Stage {stage['name']} started.")
+    start = time.perf_counter()
+    # Leaving working_database() snapshots the stage's writes to disk, where the stage
+    # fingerprints and the stages outside it read them
+    in_memory = working_db.in_memory_enabled() and stage.get('in_memory', False)
+    with metrics.timer('pipeline_stage', stage=stage['name']), profiling.profile(stage['name']), \
+            working_db.working_database(DATABASE_PATH, enabled=in_memory):
+        stage['run'](options)
+    seconds = time.perf_counter() - start
+    logger.info(f"Stage {stage['name']} finished in {seconds:.2f}s.")
+    return seconds
+
+def run_pipeline(options, stages=STAGES):
+    """Run the stage DAG, skipping up-to-date stages and running independent ones in parallel."""
+    selected = {stage['name'] for stage in stages if not options.only or stage['name'] in options.only}
+    dependencies = stage_dependencies(stages)
+    by_name = {stage['name']: stage for stage in stages}
+    state = load_state()
+    results = {}
+    pending = [stage['name'] for stage in stages]
+    running = {}
+
+    def ready(name):
+        return all(results.get(dep) in ('done', 'skipped') for dep in dependencies[name] if dep in selected)
+
+    def blocked(name):
+        return any(results.get(dep) in ('failed', 'blocked') for dep in dependencies[name])
+
+    with ThreadPoolExecutor(max_workers=options.jobs) as executor:
+        while pending or running:
+            for name in list(pending):
+                stage = by_name[name]
+                if name not in selected:
+                    results[name] = 'not selected'
+                elif blocked(name):
+                    results[name] = 'blocked'
+                    logger.error(f"Stage {name} not run because a dependency failed.")
+                elif not ready(name):
+                    continue
+                elif stage.get('destructive') and name not in (options.only or []) and database_has_schema():
+                    results[name] = 'skipped'
+                    logger.info(f"Stage {name} skipped: the database already exists (use --only {name} to recreate it).")
+                # A dependency that ran in this invocation makes this stage stale as well
+                elif (not options.force and not any(results.get(dep) == 'done' for dep in dependencies[name])
+                      and is_up_to_date(stage, state, dependencies[name])):
+                    results[name] = 'skipped'
+                    logger.info(f"Stage {name} is up to date, skipping.")
+                elif options.dry_run:
+                    results[name] = 'done'
+                    print(f"would run: {name}")
+                else:
+                    running[executor.submit(execute_stage, stage, options)] = name
+                    results[name] = 'running'
+                pending.remove(name)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    logger.exception(f"Stage {name} failed: {e}")
+                    results[name] = 'failed'
+                    state[name] = {'status': 'failed', 'finished_at': datetime.now().isoformat(timespec='microseconds')}
+                else:
+                    results[name] = 'done'
+                    # Fingerprint after the run so in-place stages see their own writes as current
+                    state[name] = {
+                        'status': 'done',
+                        'fingerprint': stage_fingerprint(by_name[name]),
+                        'seconds': round(seconds, 3),
+                        'finished_at': datetime.now().isoformat(timespec='microseconds'),
+                    }
+                save_state(state)
+
+    for stage in stages:
+        timing = state.get(stage['name'], {}).get('seconds')
+        suffix = f" ({timing}s)" if results[stage['name']] == 'done' and timing is not None else ''
+        logger.info(f"Stage {stage['name']}: {results[stage['name']]}{suffix}")
+        print(f"{stage['name']:20s} {results[stage['name']]}{suffix}")
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bibliometric pipeline stages in dependency order.")
+    parser.add_argument('--only', nargs='+', metavar='STAGE', choices=[stage['name'] for stage in STAGES],
+                        help="Run only these stages")
+    parser.add_argument('--force', action='store_true',
+                        help="Run stages even if they are up to date (init_db still needs --only init_db)")
+    parser.add_argument('--jobs', type=int, default=2, help="Stages to run in parallel")
+    parser.add_argument('--one-pass', action='store_true',
+                        help="Ingest citation edges from S2 during the papers stage")
+    parser.add_argument('--dry-run', action='store_true', help="Show which stages would run")
+    parser.add_argument('--list', action='store_true', help="List stages and their dependencies")
+    parser.add_argument('--profile', action='store_true',
+                        help="Write CPU, memory and flame graph profiles per stage (or set BIBLIO_PROFILE=1)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    # Stage modules use paths relative to the project root
+    os.chdir(project_root)
+    if options.list:
+        for name, needs in stage_dependencies(STAGES).items():
+            print(f"{name:20s} after: {', '.join(sorted(needs)) or '-'}")
+        return 0
+    metrics.start_exporter()
+    if options.profile:
+        profiling.enable()
+    if profiling.profiling_enabled() and not options.dry_run:
+        profiling.reset_combined()
+        # cProfile and tracemalloc peaks are process-wide, so profiled stages run one at a time
+        if options.jobs > 1:
+            logger.info("Profiling enabled; running stages with --jobs 1.")
+            options.jobs = 1
+    results = run_pipeline(options)
+    return 1 if any(status in ('failed', 'blocked') for status in results.values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
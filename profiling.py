@@ -0,0 +1,178 @@
+import argparse
+import cProfile
+import io
+import logging
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from config import PROFILING, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_TOP_N
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COMBINED_FILE = 'combined.folded'
+
+_lock = threading.Lock()
+_local = threading.local()
+_enabled = None  # Set by enable(); None defers to config and the BIBLIO_PROFILE environment variable
+_tracing = 0  # Number of profiled blocks currently tracking memory
+_started_tracemalloc = False
+
+def enable(flag=True):
+    """Switch profiling on (or off) for this process, e.g. from a --profile flag."""
+    global _enabled
+    _enabled = flag
+
+def profiling_enabled():
+    if _enabled is not None:
+        return _enabled
+    return PROFILING or os.environ.get('BIBLIO_PROFILE') == '1'
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack at a fixed interval and count folded stacks.
+
+    cProfile only keeps caller/callee pairs, so full stacks for flame graphs come from
+    this sampler; its output is Brendan Gregg's folded format ("a;b;c count").
+    """
+
+    def __init__(self, thread_id, root, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name=f"profile-sampler-{root}", daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join([self.root] + names[::-1])] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+def _start_memory_tracking():
+    global _tracing, _started_tracemalloc
+    with _lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+        _tracing += 1
+        # Peaks are process-wide, so stages profiled concurrently (--jobs > 1) share them
+        tracemalloc.reset_peak()
+
+def _stop_memory_tracking():
+    global _tracing, _started_tracemalloc
+    _, peak = tracemalloc.get_traced_memory()
+    allocations = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP_N]
+    with _lock:
+        _tracing -= 1
+        if _tracing == 0 and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+    return peak, allocations
+
+def write_reports(name, output_dir, profiler, stacks, elapsed, peak, allocations):
+    """Write <name>.prof, a text summary, <name>.folded and append to the combined flame graph."""
+    base = os.path.join(output_dir, name.replace(os.sep, '_'))
+    report = io.StringIO()
+    report.write(f"Stage {name}: {elapsed:.2f}s wall, peak traced memory {peak / 2**20:.1f} MiB\n\n")
+    if profiler is not None:
+        profiler.dump_stats(f"{base}.prof")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        stats.sort_stats('tottime').print_stats(PROFILE_TOP_N)
+    else:
+        report.write("No cProfile data (another profiler was active); see the .folded samples.\n\n")
+    report.write("Top allocations still live at the end of the stage:\n")
+    for statistic in allocations:
+        report.write(f"  {statistic}\n")
+    with open(f"{base}.txt", 'w') as f:
+        f.write(report.getvalue())
+
+    folded = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    with open(f"{base}.folded", 'w') as f:
+        f.write(folded)
+    with _lock:
+        with open(os.path.join(output_dir, COMBINED_FILE), 'a') as f:
+            f.write(folded)
+
+def reset_combined(output_dir=PROFILE_DIR):
+    """Start a fresh combined flame graph file for a new run."""
+    path = os.path.join(output_dir, COMBINED_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+@contextmanager
+def profile(name, output_dir=PROFILE_DIR):
+    """Profile the enclosed block when profiling is enabled; a no-op otherwise.
+
+    Collects cProfile statistics, a sampled stack profile and tracemalloc peak and top
+    allocators for the calling thread, then writes them as ``<output_dir>/<name>.*``.
+    Nested blocks in the same thread are covered by the outermost one.
+    """
+    if not profiling_enabled() or getattr(_local, 'active', False):
+        yield
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    _local.active = True
+    _start_memory_tracking()
+    sampler = StackSampler(threading.get_ident(), name)
+    sampler.start()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # From Python 3.12 cProfile uses the process-wide sys.monitoring, so only one
+        # profiler can be active at a time; keep the sampled stacks and memory data
+        logger.warning(f"cProfile unavailable for {name} ({e}); using the stack sampler only.")
+        profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        peak, allocations = _stop_memory_tracking()
+        _local.active = False
+        write_reports(name, output_dir, profiler, sampler.stacks, elapsed, peak, allocations)
+        metrics.set_gauge('profile_peak_memory_bytes', peak, stage=name)
+        logger.info(f"Profiled {name}: {elapsed:.2f}s, peak {peak / 2**20:.1f} MiB, "
+                    f"reports in {output_dir}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline script under the profiler, e.g. python profiling.py api/api_main.py")
+    parser.add_argument('--output', default=PROFILE_DIR, help="Directory for the profile reports")
+    parser.add_argument('script', help="Script to run as __main__")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="Arguments passed to the script")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    enable()
+    reset_combined(args.output)
+    # Mirror running the script directly: its own directory first on the path, its own argv
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    name = os.path.splitext(os.path.basename(args.script))[0]
+    with profile(name, args.output):
+        runpy.run_path(args.script, run_name='__main__')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import sys
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import (
+    DATABASE_PATH,
+    QUERY_SERVICE_HOST,
+    QUERY_SERVICE_PORT,
+    QUERY_POOL_SIZE,
+    QUERY_CACHE_SIZE,
+    QUERY_MAX_NODES
+)
+from logging_config import setup_logging
+import metrics
+
+# Embeddings are decoded by the same helper the feature scripts use
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_enginnering'))
+from feature_db_utils import parse_vector
+
+logger = logging.getLogger(__name__)
+
+# Keys per IN (...) query, well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+PAPER_COLUMNS = ['doi', 'paper_id', 'title', 'year', 'citation_count', 'reference_count',
+                 'influential_citation_count', 'journal_id']
+EMBEDDING_COLUMNS = ('embedding', 'title_embedding')
+
+def enable_wal(db_path):
+    """Put the database in WAL mode (a persistent setting) and return the resulting mode.
+
+    In WAL mode readers never block the ingestion writer and the writer never blocks
+    readers, so the service can read the live file while papers are being inserted.
+    """
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    finally:
+        connection.close()
+
+def open_readonly(db_path):
+    connection = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, check_same_thread=False)
+    connection.execute("PRAGMA query_only = 1")
+    return connection
+
+class ConnectionPool:
+    """Fixed-size pool of read-only connections to the live database.
+
+    In-memory runs (working_db) publish snapshots by replacing the file with os.replace;
+    a connection opened before that still sees the old inode, so it is reopened on checkout.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH, size=QUERY_POOL_SIZE):
+        self.db_path = os.path.abspath(db_path)
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put((None, None))
+
+    @contextmanager
+    def connection(self):
+        connection, inode = self.connections.get()
+        try:
+            current_inode = os.stat(self.db_path).st_ino
+            if connection is None or inode != current_inode:
+                if connection is not None:
+                    connection.close()
+                connection, inode = open_readonly(self.db_path), current_inode
+            yield connection
+        finally:
+            self.connections.put((connection, inode))
+
+    def close(self):
+        while not self.connections.empty():
+            connection, _ = self.connections.get_nowait()
+            if connection is not None:
+                connection.close()
+
+class ResultCache:
+    """Thread-safe LRU cache that empties itself whenever the database version changes."""
+
+    def __init__(self, capacity=QUERY_CACHE_SIZE):
+        self.capacity = capacity
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check_version(self, version):
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    # Every ingestion commit lands here, so this is not worth an INFO line
+                    logger.debug(f"Database changed, dropping {len(self.entries)} cached results.")
+                    metrics.increment('query_cache_invalidations_total')
+                self.entries.clear()
+                self.version = version
+
+    def get_many(self, keys):
+        """Return the cached values for ``keys`` and the keys that were not cached."""
+        found, missing = {}, []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                else:
+                    missing.append(key)
+        metrics.increment('query_cache_hits_total', len(found))
+        metrics.increment('query_cache_misses_total', len(missing))
+        return found, missing
+
+    def put_many(self, items, version):
+        """Cache ``items`` unless the database changed since the version they were loaded at."""
+        with self.lock:
+            if version != self.version:
+                return
+            for key, value in items.items():
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+def chunks(values, size=LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class QueryService:
+    """Batched read-only lookups over the project database, usable in-process or over HTTP.
+
+    Queries read the live database through a pool of read-only connections; the database
+    is switched to WAL mode so they never hold locks the ingestion writer waits for.
+    Cached results are dropped as soon as any other connection commits.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH, pool_size=QUERY_POOL_SIZE, cache_size=QUERY_CACHE_SIZE):
+        self.db_path = db_path
+        journal_mode = enable_wal(db_path)
+        if journal_mode != 'wal':
+            logger.warning(f"{db_path} is in {journal_mode} journal mode; queries may delay writers.")
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.cache = ResultCache(cache_size)
+        self.version_lock = threading.Lock()
+        self.version_connection = None
+        self.version_inode = None
+
+    def version(self):
+        """(inode, data_version) of the live database.
+
+        PRAGMA data_version changes whenever another connection commits, which in WAL
+        mode is a read of the shared-memory index rather than of the database file.
+        """
+        with self.version_lock:
+            inode = os.stat(self.db_path).st_ino
+            if self.version_connection is None or inode != self.version_inode:
+                if self.version_connection is not None:
+                    self.version_connection.close()
+                self.version_connection, self.version_inode = open_readonly(self.db_path), inode
+            return inode, self.version_connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _cached(self, kind, keys, load):
+        """Serve per-key results from the cache and fetch only the misses with ``load``."""
+        keys = list(dict.fromkeys(keys))
+        version = self.version()
+        self.cache.check_version(version)
+        found, missing = self.cache.get_many([(kind, key) for key in keys])
+        if missing:
+            with metrics.timer('query_load', kind=kind), self.pool.connection() as connection:
+                loaded = load(connection, [key for _, key in missing])
+            # Keys with no row are cached as None so repeated misses stay cheap
+            fresh = {(kind, key): loaded.get(key) for _, key in missing}
+            self.cache.put_many(fresh, version)
+            found.update(fresh)
+        return {key: found[(kind, key)] for key in keys}
+
+    def paper_features(self, dois):
+        """Stored metadata and metrics for each DOI (None for unknown DOIs)."""
+        def load(connection, keys):
+            rows = {}
+            for chunk in chunks(keys):
+                cursor = connection.execute(f"""
+                    SELECT {', '.join(PAPER_COLUMNS)} FROM Papers
+                    WHERE doi IN ({', '.join('?' for _ in chunk)})
+                """, chunk)
+                for row in cursor:
+                    rows[row[0]] = dict(zip(PAPER_COLUMNS, row))
+            return rows
+        return self._cached('paper', dois, load)
+
+    def embeddings(self, dois, column='embedding'):
+        """Decoded paper or title embeddings for each DOI."""
+        if column not in EMBEDDING_COLUMNS:
+            raise ValueError(f"Unknown embedding column: {column}")
+
+        def load(connection, keys):
+            rows = {}
+            for chunk in chunks(keys):
+                cursor = connection.execute(
+                    f"SELECT doi, {column} FROM Papers WHERE doi IN ({', '.join('?' for _ in chunk)})", chunk)
+                for doi, value in cursor:
+                    rows[doi] = parse_vector(value)
+            return rows
+        return self._cached(column, dois, load)
+
+    def _citation_links(self, dois, direction):
+        """One hop of the citation graph for each DOI as {doi: [(citing, cited), ...]}."""
+        def load(connection, keys):
+            links = {key: [] for key in keys}
+            for chunk in chunks(keys):
+                placeholders = ', '.join('?' for _ in chunk)
+                # Served by idx_citations_citing and idx_citations_cited
+                if direction in ('out', 'both'):
+                    for citing, cited in connection.execute(
+                            f"SELECT citing_doi, cited_doi FROM Citations WHERE citing_doi IN ({placeholders})", chunk):
+                        links[citing].append((citing, cited))
+                if direction in ('in', 'both'):
+                    for citing, cited in connection.execute(
+                            f"SELECT citing_doi, cited_doi FROM Citations WHERE cited_doi IN ({placeholders})", chunk):
+                        links[cited].append((citing, cited))
+            return links
+        return self._cached(f"links_{direction}", dois, load)
+
+    def neighbourhood(self, dois, hops=1, direction='both', max_nodes=QUERY_MAX_NODES):
+        """Papers and citation edges within ``hops`` of the seed DOIs, expanded breadth-first.
+
+        Each hop is one batched query for the whole frontier.  Expansion stops once
+        ``max_nodes`` papers have been reached, and ``truncated`` says so.
+        """
+        if direction not in ('in', 'out', 'both'):
+            raise ValueError(f"Unknown direction: {direction}")
+        nodes = dict.fromkeys(dois)
+        edges = set()
+        frontier = list(nodes)
+        truncated = False
+        for _ in range(hops):
+            if not frontier:
+                break
+            next_frontier = []
+            for links in self._citation_links(frontier, direction).values():
+                for citing, cited in links:
+                    edges.add((citing, cited))
+                    for doi in (citing, cited):
+                        if doi not in nodes:
+                            if len(nodes) >= max_nodes:
+                                truncated = True
+                                continue
+                            nodes[doi] = None
+                            next_frontier.append(doi)
+            frontier = next_frontier
+        edges = [edge for edge in edges if edge[0] in nodes and edge[1] in nodes]
+        return {'nodes': list(nodes), 'edges': sorted(edges), 'truncated': truncated}
+
+    def keyword_trends(self, keywords, start_year=None, end_year=None):
+        """Papers per publication year for each keyword, as {keyword: {year: count}}."""
+        def load(connection, keys):
+            trends = {}
+            for chunk in chunks(keys):
+                cursor = connection.execute(f"""
+                    SELECT k.keyword, p.year, COUNT(DISTINCT p.doi)
+                    FROM Keywords k
+                    JOIN PaperKeywords pk ON pk.keyword_id = k.id
+                    JOIN Papers p ON p.doi = pk.paper_id
+                    WHERE k.keyword IN ({', '.join('?' for _ in chunk)}) AND p.year IS NOT NULL
+                    GROUP BY k.keyword, p.year
+                """, chunk)
+                for keyword, year, count in cursor:
+                    trends.setdefault(keyword, {})[int(year)] = count
+            return trends
+
+        trends = self._cached('keyword_trend', keywords, load)
+        return {
+            keyword: {
+                year: count for year, count in sorted((counts or {}).items())
+                if (start_year is None or year >= start_year) and (end_year is None or year <= end_year)
+            }
+            for keyword, counts in trends.items()
+        }
+
+    def close(self):
+        self.pool.close()
+        with self.version_lock:
+            if self.version_connection is not None:
+                self.version_connection.close()
+                self.version_connection = None
+
+# POST endpoints: path -> (service method, accepted JSON arguments)
+ENDPOINTS = {
+    '/papers': ('paper_features', ('dois',)),
+    '/embeddings': ('embeddings', ('dois', 'column')),
+    '/neighbourhood': ('neighbourhood', ('dois', 'hops', 'direction', 'max_nodes')),
+    '/keyword_trends': ('keyword_trends', ('keywords', 'start_year', 'end_year')),
+}
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None  # Set by serve()
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok', 'version': list(self.service.version())})
+        else:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path not in ENDPOINTS:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+        method, accepted = ENDPOINTS[self.path]
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            arguments = {name: request[name] for name in accepted if name in request}
+            with metrics.timer('query_request', endpoint=self.path):
+                result = getattr(self.service, method)(**arguments)
+        except (ValueError, TypeError, KeyError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        except sqlite3.Error as e:
+            logger.error(f"Query {self.path} failed: {e}")
+            self._send(500, {'error': str(e)})
+            return
+        metrics.increment('query_requests_total', endpoint=self.path)
+        self._send(200, result)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+class QueryClient:
+    """Python client for a running query service, mirroring QueryService's methods."""
+
+    def __init__(self, base_url=f"http://{QUERY_SERVICE_HOST}:{QUERY_SERVICE_PORT}", timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            self.base_url + path, data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        with urllib.request.urlopen(self.base_url + '/health', timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def paper_features(self, dois):
+        return self._post('/papers', {'dois': list(dois)})
+
+    def embeddings(self, dois, column='embedding'):
+        return self._post('/embeddings', {'dois': list(dois), 'column': column})
+
+    def neighbourhood(self, dois, hops=1, direction='both', max_nodes=QUERY_MAX_NODES):
+        return self._post('/neighbourhood', {'dois': list(dois), 'hops': hops, 'direction': direction,
+                                             'max_nodes': max_nodes})
+
+    def keyword_trends(self, keywords, start_year=None, end_year=None):
+        # JSON object keys are strings, so years come back as int keys only in-process
+        return self._post('/keyword_trends', {'keywords': list(keywords), 'start_year': start_year,
+                                              'end_year': end_year})
+
+def serve(db_path=DATABASE_PATH, host=QUERY_SERVICE_HOST, port=QUERY_SERVICE_PORT, pool_size=QUERY_POOL_SIZE):
+    """Serve the query endpoints until interrupted."""
+    QueryHandler.service = QueryService(db_path, pool_size)
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    logger.info(f"Query service for {db_path} listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        QueryHandler.service.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve read-only paper, embedding, neighbourhood and keyword queries.")
+    parser.add_argument('--db-path', default=DATABASE_PATH)
+    parser.add_argument('--host', default=QUERY_SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=QUERY_SERVICE_PORT)
+    parser.add_argument('--pool-size', type=int, default=QUERY_POOL_SIZE)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    setup_logging()
+    args = parse_args()
+    metrics.start_exporter()
+    serve(args.db_path, args.host, args.port, args.pool_size)
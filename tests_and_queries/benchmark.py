@@ -0,0 +1,253 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Adjust sys.path before any other imports
+current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
+project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
+sys.path.insert(0, project_root)  # Add project root to the start of the search path
+for stage_dir in ('api', 'build_db', 'feature_enginnering', 'build_network'):
+    sys.path.insert(1, os.path.join(project_root, stage_dir))
+
+import config
+from init_db import create_database
+from logging_config import setup_logging
+from synthetic_corpus import generate_corpus, random_vector, synthetic_doi
+
+# Setup logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = 'data/benchmarks'
+REGRESSION_THRESHOLD = 1.2  # Flag stages that got more than 20% slower
+
+KEYWORD_QUERIES = {
+    'top_keywords': """
+        SELECT k.keyword, COUNT(*) AS papers
+        FROM PaperKeywords pk JOIN Keywords k ON pk.keyword_id = k.id
+        GROUP BY k.id ORDER BY papers DESC LIMIT 100
+    """,
+    'keyword_trend_by_year': """
+        SELECT p.year, COUNT(*) AS papers
+        FROM PaperKeywords pk JOIN Papers p ON pk.paper_id = p.doi
+        WHERE pk.keyword_id = 1
+        GROUP BY p.year ORDER BY p.year
+    """,
+    'keywords_for_recent_papers': """
+        SELECT p.doi, k.keyword
+        FROM Papers p
+        JOIN PaperKeywords pk ON p.doi = pk.paper_id
+        JOIN Keywords k ON pk.keyword_id = k.id
+        WHERE p.year BETWEEN 2015 AND 2020
+        LIMIT 1000
+    """,
+}
+
+def git_version():
+    """Identify the code version the benchmark ran against."""
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=project_root, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def timed(stage, rows, func, *args):
+    """Run one benchmark stage and return its timing record."""
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    logger.info(f"Benchmark {stage}: {rows} rows in {seconds:.3f}s")
+    return {
+        'seconds': round(seconds, 6),
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds, 2) if seconds > 0 else None
+    }
+
+def bench_insert_path(work_dir, sample, embedding_dim):
+    """Time the per-row ingestion path in db_utils on a fresh database."""
+    from db_utils import (
+        insert_paper, insert_author, insert_authorship, insert_journal,
+        insert_keywords, link_paper_keywords, insert_citation
+    )
+
+    db_path = os.path.join(work_dir, 'insert_bench.db')
+    connection = create_database(db_path)
+    papers = [{
+        'doi': synthetic_doi(index),
+        'paper_id': f"S2{index:010d}",
+        'title': f"Synthetic paper {index}",
+        'year': 2000 + index % 25,
+        'citation_count': index % 97,
+        'reference_count': index % 31,
+        'influential_citation_count': index % 7,
+        'journal': {'name': f"Synthetic Journal {index % 50}"},
+        'embedding': {'model': 'specter_v1', 'vector': random_vector(embedding_dim)},
+        'authors': [{'author_id': f"A{(index * 7 + k) % (sample + 1):09d}", 'name': f"Author {k}",
+                     'paperCount': 1, 'citationCount': 1, 'hIndex': 1} for k in range(3)]
+    } for index in range(sample)]
+
+    def run():
+        for index, paper in enumerate(papers):
+            paper['journal_id'] = insert_journal(paper['journal']['name'], connection)
+            insert_paper(paper, connection)
+            keyword_ids = insert_keywords([f"keyword {(index * k) % 500}" for k in range(1, 5)], connection)
+            link_paper_keywords(paper['doi'], keyword_ids, connection)
+            for author in paper['authors']:
+                insert_author(author, connection)
+                insert_authorship(author['author_id'], paper['doi'], connection)
+            if index:
+                insert_citation(paper['doi'], synthetic_doi(random.randrange(index)), connection)
+
+    try:
+        return timed('insert_path', sample, run)
+    finally:
+        connection.close()
+
+def bench_normalization(db_path):
+    """Time the min-max normalization that pre_numeric applies to the count columns."""
+    import pre_numeric
+
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute("SELECT COUNT(*) FROM Papers").fetchone()[0]
+    return timed('normalization', rows, pre_numeric.normalize_data)
+
+def bench_embedding_writeback(db_path, sample, embedding_dim):
+    """Time writing title and keyword embeddings back through feature_db_utils."""
+    import feature_db_utils
+
+    with sqlite3.connect(db_path) as connection:
+        dois = [row[0] for row in connection.execute("SELECT doi FROM Papers LIMIT ?", (sample,))]
+        keyword_ids = [row[0] for row in connection.execute("SELECT id FROM Keywords LIMIT ?", (sample,))]
+    vectors = [random_vector(embedding_dim) for _ in range(min(sample, 100))]
+
+    def run():
+        for index, doi in enumerate(dois):
+            feature_db_utils.insert_title_embedding(doi, vectors[index % len(vectors)])
+        for index, keyword_id in enumerate(keyword_ids):
+            feature_db_utils.insert_keyword_embedding(keyword_id, vectors[index % len(vectors)])
+
+    return timed('embedding_writeback', len(dois) + len(keyword_ids), run)
+
+def bench_graph_build(db_path):
+    """Time loading the tables and building the HeteroData graph."""
+    import build_network
+
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute("SELECT COUNT(*) FROM Papers").fetchone()[0]
+        return timed('graph_build', rows, lambda: build_network.build_graph(build_network.load_tables(connection)))
+
+def bench_keyword_queries(db_path, repeats):
+    """Time the keyword aggregation queries analysts run against the corpus."""
+    results = {}
+    with sqlite3.connect(db_path) as connection:
+        for name, query in KEYWORD_QUERIES.items():
+            results[name] = timed(f"keyword_query.{name}", repeats,
+                                  lambda q=query: [connection.execute(q).fetchall() for _ in range(repeats)])
+    return results
+
+def run_stage(results, stage, func, *args):
+    """Record a stage result, or why it was skipped, without aborting the whole suite."""
+    try:
+        results[stage] = func(*args)
+    except ImportError as e:
+        logger.warning(f"Skipping benchmark {stage}: {e}")
+        results[stage] = {'skipped': f"missing dependency: {e}"}
+    except Exception as e:
+        logger.error(f"Benchmark {stage} failed: {e}")
+        results[stage] = {'failed': str(e)}
+
+def compare_results(current, previous):
+    """Print per-stage slowdowns relative to a previous results file."""
+    regressions = []
+    for stage, record in current['stages'].items():
+        before = previous.get('stages', {}).get(stage, {})
+        records = record.items() if stage == 'keyword_queries' else [(stage, record)]
+        befores = before if stage == 'keyword_queries' else {stage: before}
+        for name, timing in records:
+            old = befores.get(name, {}).get('seconds')
+            new = timing.get('seconds')
+            if not old or not new:
+                continue
+            ratio = new / old
+            flag = 'REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+            print(f"{name:40s} {old:10.3f}s -> {new:10.3f}s  x{ratio:5.2f} {flag}")
+            if flag:
+                regressions.append(name)
+    return regressions
+
+def run_benchmarks(n_papers=10000, sample=1000, embedding_dim=768, repeats=5, seed=42, keep=False):
+    """Generate a synthetic corpus and time every pipeline stage against it."""
+    work_dir = os.path.join(RESULTS_DIR, 'work')
+    os.makedirs(work_dir, exist_ok=True)
+    corpus_path = os.path.join(work_dir, f"corpus_{n_papers}.db")
+
+    start = time.perf_counter()
+    generate_corpus(corpus_path, n_papers, embedding_dim, seed=seed)
+    generation_seconds = time.perf_counter() - start
+
+    # Feature stages mutate the database, so they run against a copy
+    feature_path = os.path.join(work_dir, 'feature_bench.db')
+    shutil.copyfile(corpus_path, feature_path)
+    original_path = config.DATABASE_PATH
+    config.DATABASE_PATH = feature_path
+    stages = {}
+    try:
+        random.seed(seed)
+        run_stage(stages, 'insert_path', bench_insert_path, work_dir, sample, embedding_dim)
+        run_stage(stages, 'normalization', bench_normalization, feature_path)
+        run_stage(stages, 'embedding_writeback', bench_embedding_writeback, feature_path, sample, embedding_dim)
+        run_stage(stages, 'graph_build', bench_graph_build, feature_path)
+        run_stage(stages, 'keyword_queries', bench_keyword_queries, corpus_path, repeats)
+    finally:
+        config.DATABASE_PATH = original_path
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'version': git_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'params': {'papers': n_papers, 'sample': sample, 'embedding_dim': embedding_dim,
+                   'repeats': repeats, 'seed': seed},
+        'corpus_generation_seconds': round(generation_seconds, 3),
+        'stages': stages
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic corpus.")
+    parser.add_argument('--papers', type=int, default=10000, help="Corpus size (10k to 10M)")
+    parser.add_argument('--sample', type=int, default=1000, help="Rows timed for the per-row write paths")
+    parser.add_argument('--embedding-dim', type=int, default=768)
+    parser.add_argument('--repeats', type=int, default=5, help="Repetitions per keyword query")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Results file (default: data/benchmarks/benchmark_<time>.json)")
+    parser.add_argument('--compare', help="Previous results file to compare against")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated databases")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run_benchmarks(args.papers, args.sample, args.embedding_dim, args.repeats, args.seed, args.keep)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+from array import array
+
+# Adjust sys.path before any other imports
+current_path = os.path.abspath(os.path.dirname(__file__))  # Path of the current script
+project_root = os.path.abspath(os.path.join(current_path, '..'))  # Parent directory of the current script
+sys.path.insert(0, project_root)  # Add project root to the start of the search path
+sys.path.insert(0, os.path.join(project_root, 'build_db'))
+
+from init_db import create_database
+from logging_config import setup_logging
+
+# Setup logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_DATABASE_PATH = 'data/synthetic_data.db'
+CHUNK_SIZE = 10000
+
+FIRST_YEAR = 1990
+LAST_YEAR = 2024
+# Share of references drawn uniformly from earlier papers; the rest copy the target of a
+# random earlier citation, i.e. preferential attachment by in-degree.  In-degrees then
+# follow a power law with exponent 1 + 1 / (1 - UNIFORM_CITATION_SHARE), about 2.4.
+UNIFORM_CITATION_SHARE = 0.3
+
+def skewed_index(n, skew):
+    """Draw an index in [0, n) whose frequency falls off as a power law (skew > 1)."""
+    return min(n - 1, int(n * random.random() ** skew))
+
+def synthetic_doi(index):
+    return f"10.5555/synth.{index:08d}"
+
+def random_vector(dim):
+    return [round(random.gauss(0.0, 1.0), 5) for _ in range(dim)]
+
+def paper_year(index, n_papers):
+    """Years increase with the paper index so citations always point back in time."""
+    # Publication volume grows over time, so the later years get more papers
+    position = (index + 0.5) / n_papers
+    return FIRST_YEAR + int((LAST_YEAR - FIRST_YEAR + 1) * position ** 0.5)
+
+def reference_count(mean_references):
+    """Out-degree drawn from a Pareto tail, capped to keep single papers reasonable."""
+    return min(int(random.paretovariate(2.0) * mean_references / 2), 50 * mean_references)
+
+def generate_journals(connection, n_journals):
+    rows = [(journal_id, f"Synthetic Journal {journal_id}") for journal_id in range(1, n_journals + 1)]
+    connection.executemany("INSERT INTO Journals (journal_id, name) VALUES (?, ?)", rows)
+    connection.commit()
+
+def generate_keywords(connection, n_keywords, embedding_dim, with_features):
+    for start in range(1, n_keywords + 1, CHUNK_SIZE):
+        rows = [
+            (keyword_id, f"keyword {keyword_id}",
+             json.dumps(random_vector(embedding_dim)) if with_features else None)
+            for keyword_id in range(start, min(start + CHUNK_SIZE, n_keywords + 1))
+        ]
+        connection.executemany("INSERT INTO Keywords (id, keyword, embedding) VALUES (?, ?, ?)", rows)
+        connection.commit()
+
+def generate_authors(connection, n_authors):
+    for start in range(0, n_authors, CHUNK_SIZE):
+        rows = []
+        for index in range(start, min(start + CHUNK_SIZE, n_authors)):
+            paper_count = int(random.paretovariate(1.5))
+            citation_count = int(paper_count * random.paretovariate(1.2) * 5)
+            h_index = min(paper_count, int(citation_count ** 0.5))
+            rows.append((f"A{index:09d}", f"Author {index}", paper_count, citation_count, h_index))
+        connection.executemany("""
+            INSERT INTO Authors (author_id, name, paperCount, citationCount, hIndex)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        connection.commit()
+
+def cited_papers(index, references, cited_so_far):
+    """Pick the earlier papers one paper cites, by preferential attachment."""
+    cited = set()
+    for _ in range(references):
+        if not cited_so_far or random.random() < UNIFORM_CITATION_SHARE:
+            cited.add(random.randrange(index))
+        else:
+            cited.add(cited_so_far[random.randrange(len(cited_so_far))])
+    return cited
+
+def generate_papers(connection, n_papers, n_authors, n_keywords, n_journals,
+                    mean_references, embedding_dim, with_features):
+    """Generate papers with their authorship, keyword and citation edges, chunk by chunk.
+
+    Papers only cite earlier papers, so citation counts are known once every paper
+    exists; they are written from the generated edges in a final pass.
+    """
+    # Cited index of every edge so far (4 bytes each) and each paper's in-degree
+    cited_so_far = array('i')
+    in_degree = array('i', bytes(4 * n_papers))
+    for start in range(0, n_papers, CHUNK_SIZE):
+        papers, authorship, paper_keywords, citations = [], [], [], []
+        for index in range(start, min(start + CHUNK_SIZE, n_papers)):
+            doi = synthetic_doi(index)
+            references = reference_count(mean_references) if index else 0
+            cited = cited_papers(index, references, cited_so_far)
+            cited_so_far.extend(cited)
+            for cited_index in cited:
+                in_degree[cited_index] += 1
+            embedding = {'model': 'specter_v1', 'vector': random_vector(embedding_dim)}
+            papers.append((
+                doi, f"S2{index:010d}", f"Synthetic paper {index}",
+                json.dumps(random_vector(embedding_dim)) if with_features else None,
+                paper_year(index, n_papers), len(cited),
+                skewed_index(n_journals, 2.0) + 1, json.dumps(embedding)
+            ))
+            for _ in range(1 + int(random.expovariate(0.4))):
+                authorship.append((f"A{skewed_index(n_authors, 2.0):09d}", doi))
+            for keyword_index in {skewed_index(n_keywords, 3.0) for _ in range(random.randint(3, 6))}:
+                paper_keywords.append((doi, keyword_index + 1))
+            citations.extend((doi, synthetic_doi(cited_index)) for cited_index in cited)
+
+        connection.executemany("""
+            INSERT INTO Papers (
+                doi, paper_id, title, title_embedding, year, reference_count, journal_id, embedding
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, papers)
+        connection.executemany("INSERT INTO Authorship (author_id, doi) VALUES (?, ?)", authorship)
+        connection.executemany("INSERT INTO PaperKeywords (paper_id, keyword_id) VALUES (?, ?)", paper_keywords)
+        connection.executemany("INSERT INTO Citations (citing_doi, cited_doi) VALUES (?, ?)", citations)
+        connection.commit()
+        logger.info(f"Generated {min(start + CHUNK_SIZE, n_papers)}/{n_papers} synthetic papers.")
+
+    for start in range(0, n_papers, CHUNK_SIZE):
+        connection.executemany("""
+            UPDATE Papers SET citation_count = ?, influential_citation_count = ? WHERE doi = ?
+        """, (
+            (in_degree[index], int(in_degree[index] * random.random() * 0.2), synthetic_doi(index))
+            for index in range(start, min(start + CHUNK_SIZE, n_papers))
+        ))
+        connection.commit()
+
+def generate_corpus(db_path=SYNTHETIC_DATABASE_PATH, n_papers=10000, embedding_dim=768,
+                    mean_references=20, with_features=False, seed=42):
+    """Create a fresh database with the init_db schema and fill it with a synthetic corpus.
+
+    Author, keyword and citation degrees follow power laws so that query and graph
+    costs scale like they would on real Web of Science data.  With ``with_features``
+    the title and keyword embeddings normally written by ``pre_text`` are filled too.
+    """
+    random.seed(seed)
+    n_authors = max(1, int(n_papers * 0.8))
+    n_keywords = max(1, int(n_papers * 0.3))
+    n_journals = max(10, n_papers // 1000)
+
+    connection = create_database(db_path)
+    # The generated database is disposable, so trade durability for insert speed
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA journal_mode = MEMORY")
+    try:
+        generate_journals(connection, n_journals)
+        generate_keywords(connection, n_keywords, embedding_dim, with_features)
+        generate_authors(connection, n_authors)
+        generate_papers(connection, n_papers, n_authors, n_keywords, n_journals,
+                        mean_references, embedding_dim, with_features)
+    finally:
+        connection.close()
+
+    logger.info(f"Synthetic corpus with {n_papers} papers written to {db_path}")
+    return db_path
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic bibliometric corpus.")
+    parser.add_argument('--db-path', default=SYNTHETIC_DATABASE_PATH)
+    parser.add_argument('--papers', type=int, default=10000, help="Number of papers (10k to 10M)")
+    parser.add_argument('--embedding-dim', type=int, default=768)
+    parser.add_argument('--mean-references', type=int, default=20)
+    parser.add_argument('--with-features', action='store_true',
+                        help="Also fill title and keyword embeddings")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    generate_corpus(args.db_path, args.papers, args.embedding_dim, args.mean_references,
+                    args.with_features, args.seed)
+    print(f"Synthetic corpus written to {args.db_path}")
@@ -0,0 +1,123 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import DATABASE_PATH, IN_MEMORY_DB, SNAPSHOT_INTERVAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Named shared-cache memory database, so every connect() in this process sees the same data
+MEMORY_URI = 'file:biblio_working_db?mode=memory&cache=shared'
+
+_lock = threading.Lock()
+_open_lock = threading.Lock()  # Serializes open/close; _lock only guards snapshots
+_state = None  # dict with the anchor connection, disk path, snapshot thread and user count while active
+
+def in_memory_enabled():
+    return IN_MEMORY_DB or os.environ.get('BIBLIO_IN_MEMORY') == '1'
+
+def connect(db_path=DATABASE_PATH):
+    """Open a connection to the working database: in memory when active, else the disk file."""
+    if _state is not None and _state['db_path'] == db_path:
+        return sqlite3.connect(MEMORY_URI, uri=True, check_same_thread=False)
+    return sqlite3.connect(db_path)
+
+def snapshot():
+    """Write the in-memory database to disk and atomically replace the on-disk file.
+
+    The copy goes to a temporary file that is fsynced before ``os.replace``, so a crash
+    at any point leaves either the previous snapshot or the new one, never a torn file.
+    """
+    with _lock:
+        if _state is None:
+            return
+        db_path = _state['db_path']
+        tmp_path = f"{db_path}.snapshot.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with metrics.timer('db_snapshot'):
+            target = sqlite3.connect(tmp_path)
+            try:
+                _state['anchor'].backup(target)
+            finally:
+                target.close()
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, db_path)
+            directory = os.path.dirname(os.path.abspath(db_path))
+            if hasattr(os, 'O_DIRECTORY'):
+                dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+    logger.info(f"Snapshot of in-memory database written to {db_path}")
+
+def _snapshot_loop(stop_event, interval):
+    while not stop_event.wait(interval):
+        try:
+            snapshot()
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Failed to snapshot in-memory database: {e}")
+
+def open_working_database(db_path=DATABASE_PATH, interval=SNAPSHOT_INTERVAL):
+    """Load the disk database into memory and start periodic snapshots back to disk.
+
+    Opening it again while it is open (nested or concurrent stages) shares the same copy;
+    it is released when the last user closes it.
+    """
+    global _state
+    with _open_lock:
+        if _state is not None:
+            _state['users'] += 1
+            return
+        anchor = sqlite3.connect(MEMORY_URI, uri=True, check_same_thread=False)
+        if os.path.exists(db_path):
+            source = sqlite3.connect(db_path)
+            try:
+                source.backup(anchor)
+            finally:
+                source.close()
+        stop_event = threading.Event()
+        thread = threading.Thread(target=_snapshot_loop, args=(stop_event, interval),
+                                  name='db-snapshot', daemon=True)
+        with _lock:
+            _state = {'anchor': anchor, 'db_path': db_path, 'stop': stop_event, 'thread': thread, 'users': 1}
+        thread.start()
+    atexit.register(close_working_database, True)
+    logger.info(f"Working on an in-memory copy of {db_path}, snapshot every {interval}s")
+
+def close_working_database(force=False):
+    """Write a snapshot and, for the last user (or with ``force``), release the in-memory database."""
+    global _state
+    with _open_lock:
+        if _state is None:
+            return
+        _state['users'] = 0 if force else _state['users'] - 1
+        if _state['users'] > 0:
+            # Other users keep the copy open; still make this user's writes durable now
+            snapshot()
+            return
+        _state['stop'].set()
+        _state['thread'].join()
+        snapshot()
+        with _lock:
+            _state['anchor'].close()
+            _state = None
+
+@contextmanager
+def working_database(db_path=DATABASE_PATH, enabled=None, interval=SNAPSHOT_INTERVAL):
+    """Run the enclosed stage in memory when enabled; data is flushed to disk on exit."""
+    if enabled is None:
+        enabled = in_memory_enabled()
+    if not enabled:
+        yield
+        return
+    open_working_database(db_path, interval)
+    try:
+        yield
+    finally:
+        close_working_database()